@@ -0,0 +1,143 @@
+import click
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from simulated_drive import SyntheticDrive, SimulatedDriveServer
+
+BACKUP_TYPES = ('complete', 'update', 'increment')
+
+def get_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+def timed(timings, name, function):
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start_time
+    return wrapper
+
+def run_backup(api_endpoint, backup_args, results):
+    # Runs in its own process, so the peak RSS belongs to this backup alone
+    from google.auth.credentials import AnonymousCredentials
+    from drive_backup.core import drivebackup, config, progress, console
+
+    timings = {}
+    console.quiet = True
+    drivebackup.client_options = {'api_endpoint': api_endpoint}
+    drivebackup.get_user_credentials = lambda: AnonymousCredentials()
+    drivebackup.get_drive_listing = timed(timings, 'listing', drivebackup.get_drive_listing)
+    drivebackup.get_folder = timed(timings, 'download', drivebackup.get_folder)
+    drivebackup.get_folder_pipelined = timed(timings, 'download', drivebackup.get_folder_pipelined)
+    drivebackup.clean_backup = timed(timings, 'cleanup', drivebackup.clean_backup)
+
+    config.set_config(backup_args)
+    start_time = time.perf_counter()
+    try:
+        drivebackup.run_drive_backup()
+        completed = True
+    except SystemExit:
+        completed = False
+    timings['total'] = time.perf_counter() - start_time
+    results.put({'completed': completed, 'timings': timings, 'files': progress.file_cnt, 'peak_rss': get_peak_rss()})
+
+def run_in_process(server, backup_args):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_backup, args=(server.api_endpoint, backup_args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def format_rate(count, seconds, unit=''):
+    if not seconds:
+        return '-'
+    rate = count / seconds
+    for prefix in ('', 'K', 'M', 'G'):
+        if rate < 1000 or prefix == 'G':
+            break
+        rate /= 1000
+    return f'{rate:.1f} {prefix}{unit}/s'
+
+@click.command(help="Run backups against a simulated Google Drive on a loopback server and report their throughput.")
+@click.option("-n", "--files", default=10_000, show_default=True, help="The number of synthetic files on the simulated Drive.")
+@click.option("--folders", default=200, show_default=True, help="The number of synthetic folders.")
+@click.option("--depth", default=4, show_default=True, help="The deepest a folder can be nested.")
+@click.option("--duplicate-ratio", default=0.01, show_default=True, help="The fraction of files with the same name as another file in their folder.")
+@click.option("--shortcut-ratio", default=0.01, show_default=True, help="The fraction of entries that are shortcuts to another file.")
+@click.option("--document-ratio", default=0.05, show_default=True, help="The fraction of files that are Google Documents and have to be exported.")
+@click.option("--max-size", default=256*1024, show_default=True, help="The largest size in bytes of a synthetic file.")
+@click.option("--changed-ratio", default=0.1, show_default=True, help="The fraction of files changed between the previous backup and an update or increment backup.")
+@click.option("--latency", default=0.0, show_default=True, help="Seconds the server waits before answering each request.")
+@click.option("--error-rate", default=0.0, show_default=True, help="The fraction of requests answered with a rate limit or server error.")
+@click.option("--shared-drives", default=0, show_default=True, help="The number of shared drives, each as big as My Drive, all of them are backed up.")
+@click.option("--page-size", default=1000, show_default=True, help="The most files the server returns in one listing page.")
+@click.option("-t", "--backup-type", "backup_types", type=click.Choice(BACKUP_TYPES), multiple=True, help="The backup types to run. Default is all of them.")
+@click.option("--scoped", is_flag=True, help="Back up the simulated Drive's root as a source folder, which lists it folder by folder.")
+@click.option("-w", "--workers", default=1, show_default=True, help="The --workers option passed to the backup.")
+@click.option("--pipeline", is_flag=True, help="Run the backups with --pipeline.")
+@click.option("--archive", type=click.Choice(['zip', 'tar.gz', 'tar.xz', 'tar.zst']), help="Run the backups with --archive, only 'complete' backups can be archived.")
+@click.option("--seed", default=1, show_default=True, help="The random seed for the synthetic Drive.")
+def main(files, folders, depth, duplicate_ratio, shortcut_ratio, document_ratio, max_size, changed_ratio, latency, error_rate,
+         shared_drives, page_size, backup_types, scoped, workers, pipeline, archive, seed):
+    def make_drive():
+        return SyntheticDrive(files=files, depth=depth, folders=folders, duplicate_ratio=duplicate_ratio,
+                              shortcut_ratio=shortcut_ratio, document_ratio=document_ratio, max_size=max_size,
+                              shared_drives=shared_drives, seed=seed)
+
+    if archive and any(backup_type != 'complete' for backup_type in backup_types or BACKUP_TYPES):
+        raise click.UsageError("Only 'complete' backups can be archived, use '-t complete' with --archive.")
+
+    server = SimulatedDriveServer(make_drive(), latency=latency, error_rate=error_rate, page_size=page_size, seed=seed)
+    server.start()
+    click.echo(f'{"type":>10}  {"pages/s":>12}  {"files/s":>12}  {"bytes/s":>12}  {"peak RSS":>10}  {"total":>8}  requests')
+    try:
+        for backup_type in backup_types or BACKUP_TYPES:
+            with tempfile.TemporaryDirectory() as destination:
+                backup_args = {
+                    'destination': destination,
+                    'notifications': False,
+                    'workers': workers,
+                    'pipeline': pipeline,
+                    'archive': archive,
+                    'shared_drives': ['all'] if shared_drives else [],
+                    'source_id': 'root-folder-id' if scoped else 'root'
+                }
+                server.drive = make_drive()
+                if backup_type != 'complete':
+                    result = run_in_process(server, backup_args | {'backup_name': 'Previous'})
+                    if not result['completed']:
+                        raise click.ClickException('The previous backup did not complete, check its log.')
+                    server.drive.touch(changed_ratio)
+
+                server.stats.reset()
+                result = run_in_process(server, backup_args | {'backup_name': 'Current', 'prev_backup_name': 'Previous', 'backup_type': backup_type})
+                if not result['completed']:
+                    log_path = Path(destination) / ('' if archive else 'Current') / 'drive-backup.log'
+                    raise click.ClickException(f"The {backup_type} backup did not complete:\n{log_path.read_text() if log_path.exists() else ''}")
+
+                timings = result['timings']
+                stats = server.stats
+                peak_rss = f"{result['peak_rss'] / 2**20:.1f} MiB" if result['peak_rss'] else '-'
+                requests = ', '.join(f'{method} {count}' for method, count in sorted(stats.requests.items()))
+                if stats.errors_injected:
+                    requests += f', {stats.errors_injected} errors'
+                click.echo(f"{backup_type:>10}  {format_rate(stats.requests.get('list', 0), timings.get('listing')):>12}  "
+                           f"{format_rate(result['files'], timings.get('download')):>12}  {format_rate(stats.bytes_sent, timings.get('download'), 'B'):>12}  "
+                           f"{peak_rss:>10}  {timings['total']:7.1f}s  {requests}")
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
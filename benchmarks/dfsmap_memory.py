@@ -0,0 +1,121 @@
+import click
+import collections
+import gc
+import random
+import time
+import tracemalloc
+
+from drive_backup.core.dfsmap import DriveFileSystemMap
+
+MIME_TYPES = [
+    'image/jpeg', 'application/pdf', 'text/plain', 'video/mp4',
+    'application/vnd.google-apps.document', 'application/vnd.google-apps.spreadsheet'
+]
+
+class LegacyDriveFileSystemMap(object):
+    # The dict based map used before the slot based records, kept here to compare against
+    Drive_folder_object = collections.namedtuple('Drive_folder_object',['name', 'files', 'folders', 'temp'])
+
+    def __init__(self, root_folder):
+        self._file_system_map = {root_folder['id']: self.Drive_folder_object(root_folder['name'], {}, {}, False)}
+        self.root_folder_id = root_folder['id']
+
+    def add_file(self, drive_object):
+        if 'parents' in drive_object:
+            for parentID in drive_object['parents']:
+                drive_folder = self._file_system_map.get(parentID)
+                if not drive_folder:
+                    self._file_system_map[parentID] = self.Drive_folder_object('TEMP', {}, {}, True)
+                    drive_folder = self._file_system_map[parentID]
+                if drive_object['id'] not in drive_folder.files:
+                    drive_folder.files[drive_object['id']] = drive_object
+
+    def add_folder(self, drive_object):
+        if 'parents' in drive_object:
+            if drive_object['id'] not in self._file_system_map:
+                self._file_system_map[drive_object['id']] = self.Drive_folder_object(drive_object['name'], {}, {}, False)
+                self._add_to_parents(drive_object)
+            elif self._file_system_map[drive_object['id']].temp:
+                temp_folder = self._file_system_map[drive_object['id']]
+                self._file_system_map[drive_object['id']] = temp_folder._replace(name=drive_object['name'], temp=False)
+                self._add_to_parents(drive_object)
+
+    def _add_to_parents(self, drive_object):
+        for parentID in drive_object['parents']:
+            parent_folder = self._file_system_map.get(parentID)
+            if not parent_folder:
+                self._file_system_map[parentID] = self.Drive_folder_object('TEMP', {}, {}, True)
+                parent_folder = self._file_system_map[parentID]
+            if drive_object['id'] not in parent_folder.folders:
+                parent_folder.folders[drive_object['id']] = drive_object
+
+def make_id(rnd):
+    return ''.join(rnd.choices('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_', k=33))
+
+def synthetic_objects(entries, folder_ratio, seed):
+    # Mimics the objects returned by files().list with the fields build_dfsmap requests
+    rnd = random.Random(seed)
+    folder_ids = ['root']
+    for index in range(entries):
+        object_id = make_id(rnd)
+        parent_id = rnd.choice(folder_ids)
+        modified_time = f'20{rnd.randint(10, 24)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}T12:34:56.789Z'
+        if rnd.random() < folder_ratio:
+            folder_ids.append(object_id)
+            yield {
+                'id': object_id,
+                'name': f'Folder {index}',
+                'mimeType': 'application/vnd.google-apps.folder',
+                'modifiedTime': modified_time,
+                'parents': [parent_id]
+            }
+            continue
+        # Decoding JSON makes a new string for every object, copy it so each one is distinct like in a real listing
+        mime_type = ''.join(list(rnd.choice(MIME_TYPES)))
+        drive_object = {
+            'id': object_id,
+            'name': f'File {index}.dat',
+            'mimeType': mime_type,
+            'modifiedTime': modified_time,
+            'parents': [parent_id],
+            'version': str(rnd.randint(1, 500))
+        }
+        if not mime_type.startswith('application/vnd.google-apps.'):
+            drive_object['size'] = str(rnd.randint(0, 10**9))
+            drive_object['md5Checksum'] = f'{rnd.getrandbits(128):032x}'
+            drive_object['headRevisionId'] = make_id(rnd) + make_id(rnd)
+        if rnd.random() < 0.02:
+            drive_object['shortcutDetails'] = {'targetId': make_id(rnd), 'targetMimeType': mime_type}
+        yield drive_object
+
+def measure(map_class, entries, folder_ratio, seed):
+    gc.collect()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    drive_file_system = map_class({'id': 'root', 'name': 'My Drive'})
+    for drive_object in synthetic_objects(entries, folder_ratio, seed):
+        if drive_object['mimeType'] == 'application/vnd.google-apps.folder':
+            drive_file_system.add_folder(drive_object)
+        else:
+            drive_file_system.add_file(drive_object)
+    elapsed = time.perf_counter() - start_time
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del drive_file_system
+    return current, peak, elapsed
+
+@click.command(help="Compare the memory used by DriveFileSystemMap against the legacy dict based map.")
+@click.option("-n", "--entries", default=1_000_000, show_default=True, help="The number of synthetic files and folders to add.")
+@click.option("--folder-ratio", default=0.05, show_default=True, help="The fraction of entries that are folders.")
+@click.option("--seed", default=1, show_default=True, help="The random seed for the synthetic entries.")
+def main(entries, folder_ratio, seed):
+    results = {}
+    for label, map_class in (('legacy', LegacyDriveFileSystemMap), ('compact', DriveFileSystemMap)):
+        current, peak, elapsed = measure(map_class, entries, folder_ratio, seed)
+        results[label] = current
+        click.echo(f'{label:>8}: {current / 2**20:9.1f} MiB retained  {peak / 2**20:9.1f} MiB peak  {elapsed:7.1f}s')
+    click.echo(f"   ratio: {results['compact'] / results['legacy']:.2f}")
+
+if __name__ == "__main__":
+    main()
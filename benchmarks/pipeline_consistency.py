@@ -0,0 +1,75 @@
+import click
+import hashlib
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from backup_throughput import run_in_process
+from simulated_drive import SyntheticDrive, SimulatedDriveServer, FOLDER_MIME_TYPE, ROOT_ID
+
+def get_largest_folder(drive):
+    # The top level folder with the most files below it, its shortcuts can point to files outside of it
+    def count_files(folder_id):
+        children = drive.children.get(folder_id, [])
+        return sum(count_files(child['id']) if child['mimeType'] == FOLDER_MIME_TYPE else 1 for child in children)
+    folders = [object for object in drive.children.get(ROOT_ID, []) if object['mimeType'] == FOLDER_MIME_TYPE]
+    return max(folders, key=lambda folder: count_files(folder['id']))['id']
+
+def read_backup(destination):
+    # The checksum of every file in the backup and the manifest record of every file, by path
+    backup = Path(destination) / 'Current'
+    files = {path.relative_to(backup).as_posix(): hashlib.md5(path.read_bytes()).hexdigest()
+             for path in backup.rglob('*') if path.is_file() and path.name != 'drive-backup.log'}
+    with sqlite3.connect(Path(destination) / 'drive-backup.manifest.db') as connection:
+        records = {row[0]: row[1:] for row in connection.execute(
+            'SELECT path, file_id, size, modified_time, md5_checksum, head_revision_id, version, export_mime_type FROM files')}
+    return files, records
+
+def compare(name, serial, pipelined):
+    differences = [f'{name} {path}: {serial.get(path)} != {pipelined.get(path)}'
+                   for path in sorted(serial.keys() | pipelined.keys()) if serial.get(path) != pipelined.get(path)]
+    return differences
+
+@click.command(help="Back up a simulated Google Drive with and without --pipeline and check both backups are the same.")
+@click.option("-n", "--files", default=2_000, show_default=True, help="The number of synthetic files on the simulated Drive.")
+@click.option("--folders", default=50, show_default=True, help="The number of synthetic folders.")
+@click.option("--shortcut-ratio", default=0.1, show_default=True, help="The fraction of entries that are shortcuts to another file.")
+@click.option("--page-size", default=100, show_default=True, help="The most files the server returns in one listing page.")
+@click.option("-w", "--workers", default=4, show_default=True, help="The --workers option passed to the backups.")
+@click.option("--seed", default=1, show_default=True, help="The random seed for the synthetic Drive.")
+def main(files, folders, shortcut_ratio, page_size, workers, seed):
+    drive = SyntheticDrive(files=files, folders=folders, shortcut_ratio=shortcut_ratio, seed=seed)
+    server = SimulatedDriveServer(drive, page_size=page_size, seed=seed)
+    server.start()
+    # The whole Drive, and a folder whose shortcuts can point to files that aren't listed
+    sources = {'My Drive': 'root', 'largest folder': get_largest_folder(drive)}
+    differences = []
+    try:
+        for source_name, source_id in sources.items():
+            backups = []
+            for pipeline in (False, True):
+                with tempfile.TemporaryDirectory() as destination:
+                    backup_args = {
+                        'destination': destination,
+                        'notifications': False,
+                        'workers': workers,
+                        'pipeline': pipeline,
+                        'source_id': source_id,
+                        'backup_name': 'Current'
+                    }
+                    result = run_in_process(server, backup_args)
+                    if not result['completed']:
+                        raise click.ClickException(f"The {'pipelined' if pipeline else 'serial'} backup of {source_name} did not complete.")
+                    backups.append(read_backup(destination))
+            (serial_files, serial_records), (pipelined_files, pipelined_records) = backups
+            source_differences = compare('file', serial_files, pipelined_files) + compare('record', serial_records, pipelined_records)
+            click.echo(f'{source_name:>15}  {len(serial_files)} files, {len(source_differences)} differences')
+            differences.extend(source_differences)
+    finally:
+        server.stop()
+
+    if differences:
+        raise click.ClickException('The pipelined backups differ from the serial backups:\n' + '\n'.join(differences[:20]))
+
+if __name__ == "__main__":
+    main()
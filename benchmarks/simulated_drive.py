@@ -0,0 +1,279 @@
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+SHORTCUT_MIME_TYPE = 'application/vnd.google-apps.shortcut'
+BINARY_MIME_TYPES = ['image/jpeg', 'application/pdf', 'text/plain', 'video/mp4']
+DOCUMENT_MIME_TYPES = ['application/vnd.google-apps.document', 'application/vnd.google-apps.spreadsheet']
+EXPORT_SIZE = 16*1024
+ROOT_ID = 'root-folder-id'
+
+def make_id(rnd):
+    return ''.join(rnd.choices('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_', k=33))
+
+def make_modified_time(rnd):
+    return f'20{rnd.randint(10, 24)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}T12:34:56.789Z'
+
+def file_content(file_id, size):
+    # Content is rebuilt from the id whenever it is requested, so large trees don't have to be held in memory
+    block = hashlib.sha256(file_id.encode()).digest() * 128
+    return (block * (size // len(block) + 1))[:size]
+
+class SyntheticDrive(object):
+    # A Drive account in memory, shaped like the objects files().list returns with the fields drivebackup requests
+    def __init__(self, files=10_000, depth=4, folders=200, duplicate_ratio=0.01, shortcut_ratio=0.01,
+                 document_ratio=0.05, max_size=256*1024, shared_drives=0, seed=1):
+        # Every shared drive gets a tree as big as My Drive's
+        rnd = random.Random(seed)
+        self.objects = {ROOT_ID: {'id': ROOT_ID, 'name': 'My Drive', 'mimeType': FOLDER_MIME_TYPE}}
+        self.shared_drives = []
+        self._rnd = rnd
+        tree_args = (files, depth, folders, duplicate_ratio, shortcut_ratio, document_ratio, max_size)
+        self._drive_ids = {object_id: None for object_id in self._add_tree(ROOT_ID, *tree_args)}
+        for index in range(shared_drives):
+            drive_id = make_id(rnd)
+            self.shared_drives.append({'id': drive_id, 'name': f'Shared Drive {index}'})
+            self._drive_ids.update((object_id, drive_id) for object_id in self._add_tree(drive_id, *tree_args))
+        self._order_listing()
+
+    def _add_tree(self, root_id, files, depth, folders, duplicate_ratio, shortcut_ratio, document_ratio, max_size):
+        rnd = self._rnd
+        object_ids = []
+        folder_ids = [root_id]
+        folder_depths = {root_id: 0}
+        for index in range(folders):
+            parent_id = rnd.choice([folder_id for folder_id in folder_ids if folder_depths[folder_id] < depth] or [root_id])
+            folder_id = make_id(rnd)
+            folder_ids.append(folder_id)
+            object_ids.append(folder_id)
+            folder_depths[folder_id] = folder_depths[parent_id] + 1
+            self.objects[folder_id] = {
+                'id': folder_id,
+                'name': f'Folder {index}',
+                'mimeType': FOLDER_MIME_TYPE,
+                'modifiedTime': make_modified_time(rnd),
+                'parents': [parent_id]
+            }
+
+        file_ids = []
+        for index in range(files):
+            file_id = make_id(rnd)
+            object_ids.append(file_id)
+            parent_id = rnd.choice(folder_ids)
+            if file_ids and rnd.random() < shortcut_ratio:
+                target = self.objects[rnd.choice(file_ids)]
+                self.objects[file_id] = {
+                    'id': file_id,
+                    'name': f"Shortcut to {target['name']}",
+                    'mimeType': SHORTCUT_MIME_TYPE,
+                    'modifiedTime': make_modified_time(rnd),
+                    'parents': [parent_id],
+                    'shortcutDetails': {'targetId': target['id'], 'targetMimeType': target['mimeType']}
+                }
+                continue
+            name = f'File {index}.dat'
+            if file_ids and rnd.random() < duplicate_ratio:
+                name = self.objects[file_ids[-1]]['name']
+                parent_id = self.objects[file_ids[-1]]['parents'][0]
+            file_ids.append(file_id)
+            if rnd.random() < document_ratio:
+                self.objects[file_id] = {
+                    'id': file_id,
+                    'name': name.removesuffix('.dat'),
+                    'mimeType': rnd.choice(DOCUMENT_MIME_TYPES),
+                    'modifiedTime': make_modified_time(rnd),
+                    'parents': [parent_id],
+                    'version': str(rnd.randint(1, 500))
+                }
+                continue
+            size = rnd.randint(0, max_size)
+            self.objects[file_id] = {
+                'id': file_id,
+                'name': name,
+                'mimeType': rnd.choice(BINARY_MIME_TYPES),
+                'modifiedTime': make_modified_time(rnd),
+                'parents': [parent_id],
+                'size': str(size),
+                'md5Checksum': hashlib.md5(file_content(file_id, size)).hexdigest(),
+                'headRevisionId': make_id(rnd),
+                'version': str(rnd.randint(1, 500))
+            }
+        return object_ids
+
+    def _order_listing(self):
+        # files().list is called with orderBy='folder desc', folders come first
+        # and each shared drive is listed on its own with corpora='drive'
+        listing = sorted((object for object in self.objects.values() if object['id'] != ROOT_ID),
+                         key=lambda object: object['mimeType'] != FOLDER_MIME_TYPE)
+        self.listing = [object for object in listing if self._drive_ids[object['id']] is None]
+        self.drive_listings = {shared_drive['id']: [] for shared_drive in self.shared_drives}
+        self.children = {}
+        for object in listing:
+            if self._drive_ids[object['id']] is not None:
+                self.drive_listings[self._drive_ids[object['id']]].append(object)
+            for parent_id in object['parents']:
+                self.children.setdefault(parent_id, []).append(object)
+
+    def touch(self, ratio):
+        # Marks a fraction of the files as changed, so update and increment backups have something to download
+        changed = 0
+        for object in self.objects.values():
+            if 'size' in object and self._rnd.random() < ratio:
+                object['modifiedTime'] = '2030-01-01T00:00:00.000Z'
+                changed += 1
+        return changed
+
+    def get_content(self, object):
+        if 'size' in object:
+            return file_content(object['id'], int(object['size']))
+        return file_content(object['id'] + object.get('version', ''), EXPORT_SIZE)
+
+class DriveStats(object):
+    def __init__(self):
+        self.requests = {}
+        self.bytes_sent = 0
+        self.errors_injected = 0
+        self._lock = threading.Lock()
+
+    def count(self, method, bytes_sent=0):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            self.bytes_sent += bytes_sent
+
+    def count_error(self):
+        with self._lock:
+            self.errors_injected += 1
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.bytes_sent = 0
+            self.errors_injected = 0
+
+class DriveRequestHandler(BaseHTTPRequestHandler):
+    # Answers the Drive v3 requests drivebackup makes, with the service's api_endpoint pointed at this server
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        parts = [urllib.parse.unquote(part) for part in url.path.strip('/').split('/')]
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.random.random() < server.error_rate:
+            server.stats.count_error()
+            if server.random.random() < 0.5:
+                return self.send_json({'error': {'code': 429, 'errors': [{'reason': 'rateLimitExceeded'}]}}, status=429, headers={'Retry-After': '0'})
+            return self.send_json({'error': {'code': 503, 'errors': [{'reason': 'backendError'}]}}, status=503)
+
+        if parts == ['about']:
+            server.stats.count('about')
+            return self.send_json({'user': {'displayName': 'Benchmark User', 'emailAddress': 'benchmark@example.com'}})
+        if parts == ['changes', 'startPageToken']:
+            server.stats.count('startPageToken')
+            return self.send_json({'startPageToken': '1'})
+        if parts == ['drives']:
+            server.stats.count('drives')
+            return self.send_json({'drives': server.drive.shared_drives})
+        if parts == ['files']:
+            return self.list_files(params)
+        if len(parts) == 2 and parts[0] == 'files':
+            object = self.get_object(parts[1])
+            if object is None:
+                return self.send_json({'error': {'code': 404, 'errors': [{'reason': 'notFound'}]}}, status=404)
+            if params.get('alt') == 'media':
+                return self.send_media('get_media', server.drive.get_content(object))
+            server.stats.count('get')
+            return self.send_json(object)
+        if len(parts) == 3 and parts[0] == 'files' and parts[2] == 'export':
+            object = self.get_object(parts[1])
+            return self.send_media('export_media', server.drive.get_content(object))
+        self.send_json({'error': {'code': 404, 'errors': [{'reason': 'notFound'}]}}, status=404)
+
+    def get_object(self, file_id):
+        if file_id == 'root':
+            file_id = ROOT_ID
+        return self.server.drive.objects.get(file_id)
+
+    def list_files(self, params):
+        server = self.server
+        server.stats.count('list')
+        query = params.get('q', '')
+        parent_ids = [part.split("'")[1] for part in query.split(' or ') if "' in parents" in part]
+        if parent_ids:
+            parent_ids = [ROOT_ID if parent_id == 'root' else parent_id for parent_id in parent_ids]
+            objects = [object for parent_id in parent_ids for object in server.drive.children.get(parent_id, [])]
+            if "name='" in query:
+                name = query.split("name='")[1].split("'")[0]
+                objects = [object for object in objects if object['name'] == name]
+        elif params.get('corpora') == 'drive':
+            objects = server.drive.drive_listings.get(params.get('driveId'), [])
+        else:
+            objects = server.drive.listing
+        page_size = min(int(params.get('pageSize', 100)), server.page_size)
+        start = int(params.get('pageToken', 0))
+        result = {'files': objects[start:start + page_size]}
+        if start + page_size < len(objects):
+            result['nextPageToken'] = str(start + page_size)
+        self.send_json(result)
+
+    def send_media(self, method, content):
+        total_size = len(content)
+        status = 200
+        headers = {}
+        range_header = self.headers.get('Range')
+        if range_header and range_header.startswith('bytes='):
+            first, _, last = range_header[len('bytes='):].partition('-')
+            first = int(first)
+            last = min(int(last) if last else total_size - 1, total_size - 1)
+            content = content[first:last + 1]
+            status = 206
+            headers['Content-Range'] = f'bytes {first}-{last}/{total_size}'
+        self.server.stats.count(method, len(content))
+        self.send_body(content, 'application/octet-stream', status, headers)
+
+    def send_json(self, data, status=200, headers=None):
+        self.send_body(json.dumps(data).encode('utf-8'), 'application/json', status, headers)
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+class SimulatedDriveServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, drive, latency=0.0, error_rate=0.0, page_size=1000, seed=1):
+        super().__init__(('127.0.0.1', 0), DriveRequestHandler)
+        self.drive = drive
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.stats = DriveStats()
+        self._thread = None
+
+    @property
+    def api_endpoint(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='simulated-drive', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -1,7 +1,9 @@
-from drive_backup.core import console, config, progress, run_drive_backup, sign_out_user, sign_in_user, view_user_info, get_macos_notification_authorization
-from rich.progress import Progress, TextColumn, BarColumn, MofNCompleteColumn, TimeElapsedColumn, TaskProgressColumn
-from rich.table import Column
+from drive_backup.core import console, config, progress, run_drive_backup, plan_drive_backup, view_store_info, collect_store_garbage, list_archive_files, extract_archive_file, BackupJobRunner, get_user_credentials, sign_out_user, sign_in_user, view_user_info, get_macos_notification_authorization
+from rich.progress import Progress, ProgressColumn, TextColumn, BarColumn, MofNCompleteColumn, TimeElapsedColumn, TaskProgressColumn
+from rich import filesize
+from rich.table import Column, Table
 from rich.text import Text
+from pathlib import Path
 import platform
 import click
 import logging, sys
@@ -12,19 +14,42 @@ class GDBMofNCompleteColumn(MofNCompleteColumn):
             return Text()
         return super().render(task)
 
-columns = [
-    TextColumn("[progress.description]{task.description}"),
-    BarColumn(bar_width=None, complete_style="bar.finished", pulse_style="bar.finished"),
-    GDBMofNCompleteColumn(),
-    TaskProgressColumn(),
-    TimeElapsedColumn(table_column=Column(justify="right", min_width=7))
-]
+class GDBTransferSpeedColumn(ProgressColumn):
+    def render(self, task):
+        speed = task.fields.get("speed")
+        if speed is None:
+            return Text()
+        return Text(f"{filesize.decimal(int(speed))}/s", style="progress.data.speed")
+
+class GDBTimeRemainingColumn(ProgressColumn):
+    def render(self, task):
+        eta = task.fields.get("eta")
+        if eta is None:
+            return Text()
+        minutes, seconds = divmod(int(eta), 60)
+        hours, minutes = divmod(minutes, 60)
+        return Text(f"eta {hours:d}:{minutes:02d}:{seconds:02d}", style="progress.remaining")
+
+def make_columns():
+    return [
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(bar_width=None, complete_style="bar.finished", pulse_style="bar.finished"),
+        GDBMofNCompleteColumn(),
+        TaskProgressColumn(),
+        GDBTransferSpeedColumn(),
+        TimeElapsedColumn(table_column=Column(justify="right", min_width=7)),
+        GDBTimeRemainingColumn()
+    ]
+
+columns = make_columns()
 progress_bar = Progress(*columns, console=console)
 task = progress_bar.add_task("[green]Ready...", total=None, visible=False)
 
 def update(progress):
     total = None
     completed = progress.file_cnt
+    speed = None
+    eta = None
     visible = False
     description = "[green]Ready..."
 
@@ -34,6 +59,8 @@ def update(progress):
         description = "[green]Preparing..."
     elif progress.state == progress.State.DOWNLOAD:
         total = progress.total_files
+        speed = progress.speed
+        eta = progress.eta
         description = "[green]Downloading..."
     elif progress.state == progress.state.PAUSE:
         description = "[yellow]Paused..."
@@ -49,7 +76,7 @@ def update(progress):
     if progress.state in (progress.State.INITIATE, progress.State.PREPARE, progress.State.DOWNLOAD, progress.state.COMPLETE, progress.state.STOP):
         visible = True
 
-    progress_bar.update(task, description=description, completed=completed, total=total, visible=visible)
+    progress_bar.update(task, description=description, completed=completed, total=total, visible=visible, speed=speed, eta=eta)
 
     if progress_bar.live.is_started and progress.state == progress.state.PAUSE:
         progress_bar.stop()
@@ -120,6 +147,50 @@ def sign_in_drive_credentials(client_credentials):
 def view_credential_info():
     view_user_info()
 
+@cli.group(help="Manage the content store used by backups with '--store content'.")
+def store():
+    pass
+
+store_options = [
+    click.option("-d", "--destination", help="The destination in the file system where the backups are stored. Default is the current directory."),
+    click.option("-c", "--backup-config", is_flag=False, flag_value=True, help="The path to the .bkp backup config file of the backups, used to find the content store.")
+]
+
+def add_options(options):
+    def decorator(function):
+        for option in reversed(options):
+            function = option(function)
+        return function
+    return decorator
+
+@store.command("info", help="Show how much space the content store saves.")
+@add_options(store_options)
+def view_content_store_info(**args):
+    config.set_config({ key:value for key, value in args.items() if value is not None })
+    view_store_info()
+
+@store.command("gc", help="Remove content no backup uses anymore, run this after deleting backups.")
+@add_options(store_options)
+def clean_content_store(**args):
+    config.set_config({ key:value for key, value in args.items() if value is not None })
+    collect_store_garbage()
+
+@cli.group(help="Look inside backups saved with '--archive'.")
+def archive():
+    pass
+
+@archive.command("list", help="List the files in an archive.")
+@click.argument("archive_path", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+def view_archive_files(archive_path):
+    list_archive_files(archive_path)
+
+@archive.command("extract", help="Extract one file from an archive without reading the rest of it.")
+@click.argument("archive_path", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.argument("name")
+@click.option("-o", "--output", help="Where to save the file. Default is the file's name in the current directory.")
+def extract_archive(archive_path, name, output):
+    extract_archive_file(archive_path, name, output)
+
 @cli.command("backup", help="Run a backup for your Google Drive.")
 @click.option("-d", "--destination", help="The destination in the file system where the backup should be stored. Default is the current directory.")
 @click.option("-n", "--backup-name", help="The name of the backup. This will be used as the name of the folder the backup source is stored in. Default when not given or empty is 'Google Drive Backup' followed by the date.")
@@ -142,6 +213,11 @@ def view_credential_info():
 )
 @click.option("-s", "--source", help="The source folder on Google Drive to backup. If not given or empty, the default is everything on Google Drive.")
 @click.option("--source-id", help="The source folder id on Google Drive to backup. Default is 'root', which is everything on Google Drive.")
+@click.option("--shared-drive", "shared_drives", multiple=True,
+    help=("A shared drive to back up along with the source, by name or id. Give it more than once to back up several shared drives, or use "
+    "'all' to back up every shared drive. Each shared drive is listed on its own at the same time and saved in a 'Shared drives' folder in "
+    "the backup. Default is no shared drives.")
+)
 @click.option("--google-doc-mimeType", type=click.Choice(['msoffice', 'pdf'], case_sensitive=False),
     help="The desired mimeType conversion on all compatible Google Document types. Default is to convert documents to their 'msoffice' compatible type."
 )
@@ -151,13 +227,82 @@ def view_credential_info():
 )
 @click.option("--log-filter/--no-log-filter", default=None, help="Only log messages generated from Google Drive Backup, ignore messages from other libraries. If neither option is given, all messages are logged.")
 @click.option("--log-changes/--no-log-changes", default=None, help="Only log files that need to be downloaded. If neither option is given, all files are logged.")
+@click.option("--log-format", type=click.Choice(['text', 'json'], case_sensitive=False),
+    help="The format of the log file. 'json' writes one JSON object per line, and records about a file also have its path and what happened to it. Default is 'text'."
+)
+@click.option("--log-async/--no-log-async", default=None,
+    help="Write the log file on a background thread so logging doesn't slow down downloads when the log is on a slow drive. If neither option is given, the log is written as messages are logged."
+)
 @click.option("--log-path",
     help=("The path to the log file. If not set or set with an empty path, the log file is stored alongside the directory where the backup is stored. If this flag points to a directory, the log file is stored in the "
     "directory with the default name. If this flag points to a file, it is used to store the logs.")
 )
 @click.option("--notifications/--no-notifications", default=None, help="Will (not) trigger notifications on completion or failure. If neither option is given, notifications will be triggered.")
+@click.option("--manifest/--no-manifest", default=None,
+    help=("Keep an index of the files in each backup next to the .bkp file and use it to decide which files are already backed up, instead of "
+    "checking every file in the backup. If neither option is given, the index is used.")
+)
+@click.option("--change-detection", type=click.Choice(['modified', 'checksum', 'hash'], case_sensitive=False),
+    help=("How to decide if a file changed since it was backed up. 'modified' compares modified times. 'checksum' compares the checksum, revision "
+    "and version Google Drive reports with the ones recorded in the backup's index. 'hash' does the same and also hashes files that are not in "
+    "the index yet, so files that were copied or touched are not downloaded again. Default is 'modified'.")
+)
+@click.option("--snapshot-mode", type=click.Choice(['copy', 'hardlink', 'clone'], case_sensitive=False),
+    help=("How a 'complete' backup stores files that have not changed since the previous backup. 'copy' copies them. 'hardlink' links them to the "
+    "previous backup's file so they take up no extra space. 'clone' makes a copy-on-write clone on filesystems that support it (e.g. btrfs, xfs). "
+    "'hardlink' and 'clone' fall back to copying when they are not supported, these copies run in parallel with --workers. Default is 'copy'.")
+)
+@click.option("--store", type=click.Choice(['files', 'content'], case_sensitive=False),
+    help=("How files are stored. 'files' stores every file in each backup. 'content' stores the content of every file once next to the .bkp "
+    "file, and every backup that has the same content links to it, so identical files in the same or different backups take up space once. "
+    "This needs a destination that supports hardlinks. Default is 'files'.")
+)
+@click.option("--archive", type=click.Choice(['zip', 'tar.gz', 'tar.xz', 'tar.zst'], case_sensitive=False),
+    help=("Save the backup as an archive instead of a folder. Files are compressed into the archive as they are downloaded, and an index "
+    "saved next to it lets 'dbackup archive extract' get a single file without reading the whole archive. Archived backups are always "
+    "'complete' backups. 'tar.zst' needs the zstandard package. Default is to save a folder.")
+)
+@click.option("--resume", is_flag=True, default=None,
+    help=("Resume the last backup if it was interrupted. The Drive listing and the files finished before the backup stopped are taken from the "
+    "backup's journal instead of being fetched and checked again. This is not stored in the .bkp file.")
+)
+@click.option("--dry-run", is_flag=True, default=None,
+    help=("List Google Drive and decide what the backup would do without downloading or changing anything. The number of files and bytes "
+    "for each action is shown along with the free space at the destination. This is not stored in the .bkp file.")
+)
+@click.option("--plan-file",
+    help=("The path to a backup plan file. With --dry-run the plan is saved to this file. Without --dry-run the backup uses the decisions "
+    "saved in the plan instead of checking each file again, files that are not in the plan are checked like normal. This is not stored in the .bkp file.")
+)
+@click.option("--max-requests-per-second", type=click.FloatRange(min=0, min_open=True),
+    help="Limit how many requests per second are sent to Google Drive, across all workers. Default is no limit."
+)
+@click.option("--max-concurrent-requests", type=click.IntRange(min=1),
+    help="Limit how many requests can be waiting on Google Drive at the same time, across all workers. Default is no limit."
+)
+@click.option("--pipeline/--no-pipeline", default=None,
+    help=("List Google Drive in the background and start downloading folders as soon as they are listed, instead of waiting for the whole "
+    "listing. The total number of files is an estimate until the listing finishes. If neither option is given, the listing finishes first.")
+)
+@click.option("-w", "--workers", type=click.IntRange(min=1),
+    help=("The number of files to download at the same time. Each worker uses its own connection to Google Drive. Default is 1, which downloads "
+    "files one at a time.")
+)
+@click.option("--export-workers", type=click.IntRange(min=1),
+    help=("The number of Google Documents to export at the same time. Exports are queued separately from other files when --workers is more "
+    "than 1, so slow exports don't hold up other downloads. Default is 1.")
+)
+@click.option("--export-cache/--no-export-cache", default=None,
+    help=("Keep a copy of every exported Google Document next to the .bkp file and use it instead of exporting documents that haven't "
+    "changed again, including in backups with a different name. If neither option is given, documents are always exported.")
+)
+@click.option("--export-cache-size", type=click.IntRange(min=0),
+    help="The most space in MB the export cache can use, the least recently used documents are removed when it is full. Default is 1024."
+)
+@click.option("--download-retries", type=click.IntRange(min=0), help="How many times to retry a failed request while downloading a file. Default is 5.")
+@click.option("--export-retries", type=click.IntRange(min=0), help="How many times to retry a failed request while exporting a Google Document. Default is 5.")
 def run_backup(**args):
-    args = { key:value for key, value in args.items() if value is not None }
+    args = { key:value for key, value in args.items() if value is not None and value != () }
     config.set_config(args)
 
     setup_logging()
@@ -167,7 +312,84 @@ def run_backup(**args):
 
     with progress_bar:
         progress.subscribe(update)
-        run_drive_backup()
+        if config.dry_run:
+            plan_drive_backup()
+        else:
+            run_drive_backup()
+
+JOB_DESCRIPTIONS = {
+    'READY': "[green]Waiting...",
+    'INITIATE': "[green]Initiated...",
+    'PREPARE': "[green]Preparing...",
+    'DOWNLOAD': "[green]Downloading...",
+    'PAUSE': "[yellow]Paused...",
+    'COMPLETE': "[green]Completed...",
+    'STOP': "[red]Stopped..."
+}
+
+@cli.command("backup-all", help="Run the backups of several .bkp backup config files at the same time.")
+@click.argument("backup_configs", nargs=-1, required=True, type=click.Path(exists=True, path_type=Path))
+@click.option("-w", "--workers", type=click.IntRange(min=1),
+    help=("The most requests all of the backups together can have waiting on Google Drive at the same time. Each backup still downloads "
+    "with the workers set in its .bkp file. Default is no shared limit.")
+)
+@click.option("-j", "--max-jobs", type=click.IntRange(min=1), help="The most backups to run at the same time. Default is all of them.")
+def run_all_backups(backup_configs, workers, max_jobs):
+    setup_logging()
+
+    # Sign in once here, so the backups don't each ask for it
+    if not get_user_credentials():
+        sys.exit(1)
+
+    job_bar = Progress(TextColumn("[bold]{task.fields[job]}"), *make_columns(), console=console)
+    job_tasks = {}
+
+    def update_job(job):
+        state = job.progress['state']
+        if job.result is not None:
+            state = 'COMPLETE' if job.result['completed'] else 'STOP'
+        downloading = state == 'DOWNLOAD'
+        job_bar.update(
+            job_tasks[job.index],
+            description=JOB_DESCRIPTIONS[state],
+            completed=job.progress['files'],
+            total=job.progress['total_files'] if downloading else None,
+            speed=job.progress['speed'] if downloading else None,
+            eta=job.progress['eta'] if downloading else None
+        )
+        if job.result is not None:
+            job_bar.stop_task(job_tasks[job.index])
+
+    runner = BackupJobRunner(backup_configs, workers, max_jobs, on_update=update_job)
+    with job_bar:
+        for job in runner.jobs:
+            job_tasks[job.index] = job_bar.add_task(JOB_DESCRIPTIONS['READY'], job=job.name, total=None, speed=None, eta=None)
+        jobs = runner.run()
+
+    table = Table(title="Backups", title_style="cyan bold", title_justify="left")
+    for heading in ("Backup", "Result", "Files", "Downloaded", "Time", "Destination"):
+        table.add_column(heading, justify="right" if heading in ("Files", "Downloaded", "Time") else "left")
+    for job in jobs:
+        result = job.result
+        if result.get('completed'):
+            status = "[green]Complete"
+            if result['export_errors']:
+                status += f" [yellow]({result['export_errors']} not exported)"
+        else:
+            status = "[red]Failed"
+        table.add_row(
+            job.name,
+            status,
+            str(result.get('files', '-')),
+            filesize.decimal(result['downloaded_bytes']) if 'downloaded_bytes' in result else '-',
+            f"{result['elapsed']:.1f}s" if 'elapsed' in result else '-',
+            result.get('destination', str(job.backup_config.parent))
+        )
+    console.print()
+    console.print(table)
+
+    if not all(job.result.get('completed') for job in jobs):
+        sys.exit(1)
 
 def main():
     rc = 1
@@ -3,5 +3,17 @@ from .config import config, DEFAULT_BACKUP_CONFIG, DEFAULT_LOG
 from .progress import progress
 from .notifications import show_notification, get_macos_notification_authorization
 from .credentials import get_user_credentials, sign_out_user, sign_in_user, view_user_info
-from .dfsmap import DriveFileSystemMap
-from .drivebackup import run_drive_backup
+from .dfsmap import DriveFileSystemMap, DriveFile, DriveFolder
+from .manifest import BackupManifest
+from .journal import BackupJournal
+from .snapshot import snapshot_file
+from .download import ChunkedDownload, DownloadTracker
+from .scheduler import RequestScheduler
+from .stats import BackupStats
+from .cleanup import BackupCleanup
+from .exportcache import ExportCache
+from .store import ContentStore
+from .plan import BackupPlan
+from .archive import BackupArchive
+from .drivebackup import run_drive_backup, plan_drive_backup, view_store_info, collect_store_garbage, list_archive_files, extract_archive_file
+from .jobs import BackupJobRunner
@@ -0,0 +1,256 @@
+import gzip
+import json
+import lzma
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class BackupArchive(object):
+    # Writes a backup straight into an archive instead of a folder. Workers hand each file over in a
+    # buffer and a writer thread compresses it into the archive, so downloads don't wait on compression.
+    # Tar archives are compressed in frames that each start a new compressed stream, and the index
+    # saved next to the archive has the frame every file is in, so one file can be extracted without
+    # decompressing everything before it. The archive is written to a .part file until it is closed.
+    FORMATS = {'zip': '.zip', 'tar.gz': '.tar.gz', 'tar.xz': '.tar.xz', 'tar.zst': '.tar.zst'}
+    INDEX_SUFFIX = '.index.json'
+    PART_SUFFIX = '.part'
+    # Uncompressed bytes in a frame before the next file starts a new one
+    FRAME_SIZE = 4 * 1024 * 1024
+    # Bytes of a file kept in memory before its buffer moves to a temporary file
+    BUFFER_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, archive_path, archive_format, max_pending=2):
+        if archive_format == 'tar.zst' and zstandard is None:
+            raise ImportError("'tar.zst' archives need the zstandard package, install it with 'pip install drive-backup[zstd]'.")
+        self.path = archive_path
+        self.format = archive_format
+        self.index = {}
+        self.error = None
+        self._part_path = archive_path.with_name(archive_path.name + self.PART_SUFFIX)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._fileobj = self._part_path.open('wb')
+        if archive_format == 'zip':
+            self._zip = zipfile.ZipFile(self._fileobj, 'w', compression=zipfile.ZIP_DEFLATED)
+        else:
+            self._stream = FrameWriter(self._fileobj, COMPRESSORS[archive_format])
+            self._tar = tarfile.open(fileobj=self._stream, mode='w', format=tarfile.PAX_FORMAT)
+        self._thread = threading.Thread(target=self._write, name='archive', daemon=True)
+        self._thread.start()
+
+    @property
+    def supports_links(self):
+        return self.format != 'zip'
+
+    @classmethod
+    def get_archive_path(cls, save_destination, archive_format):
+        return save_destination.with_name(save_destination.name + cls.FORMATS[archive_format])
+
+    @classmethod
+    def get_index_path(cls, archive_path):
+        return archive_path.with_name(archive_path.name + cls.INDEX_SUFFIX)
+
+    def new_buffer(self):
+        return tempfile.SpooledTemporaryFile(max_size=self.BUFFER_SIZE)
+
+    def add_folder(self, name):
+        self._put(('folder', name, None, time.time()))
+
+    def add_file(self, name, buffer, mtime):
+        # The archive takes over the buffer and closes it once it is written
+        buffer.seek(0)
+        self._put(('file', name, buffer, mtime))
+
+    def add_link(self, name, target):
+        self._put(('link', name, target, time.time()))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self.error:
+            raise self.error
+        if self.format == 'zip':
+            self._zip.close()
+        else:
+            self._tar.close()
+            self._stream.close()
+        self._fileobj.close()
+        self._part_path.replace(self.path)
+        with self.get_index_path(self.path).open('w') as f:
+            json.dump({'format': self.format, 'files': self.index}, f)
+
+    def abort(self):
+        # Workers still adding files get the error, the unfinished archive is removed
+        self.error = self.error or OSError('The archive was closed before the backup finished.')
+        self._queue.put(None)
+        self._thread.join()
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None and item[0] == 'file':
+                item[2].close()
+        try:
+            if self.format == 'zip':
+                self._zip.close()
+            else:
+                self._tar.close()
+        except Exception:
+            pass
+        self._fileobj.close()
+        self._part_path.unlink(missing_ok=True)
+
+    def _put(self, item):
+        if self.error:
+            raise self.error
+        self._queue.put(item)
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            kind, name, data, mtime = item
+            try:
+                if not self.error:
+                    if self.format == 'zip':
+                        self._write_zip(kind, name, data, mtime)
+                    else:
+                        self._write_tar(kind, name, data, mtime)
+            except Exception as e:
+                # Reported to the workers the next time they add to the archive
+                self.error = e
+            finally:
+                if kind == 'file':
+                    data.close()
+
+    def _write_tar(self, kind, name, data, mtime):
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.mtime = mtime
+        if kind == 'folder':
+            tarinfo.type = tarfile.DIRTYPE
+            tarinfo.mode = 0o755
+            self._tar.addfile(tarinfo)
+            return
+        tarinfo.mode = 0o644
+        if kind == 'link':
+            tarinfo.type = tarfile.LNKTYPE
+            tarinfo.linkname = data
+            self._tar.addfile(tarinfo)
+            self.index[name] = {'link': data}
+            return
+        tarinfo.size = data.seek(0, 2)
+        data.seek(0)
+        if self._stream.frame_size() >= self.FRAME_SIZE:
+            self._stream.end_frame()
+        header_position = self._stream.tell()
+        self._tar.addfile(tarinfo, data)
+        self.index[name] = {
+            'frame': self._stream.frame_offset,
+            'offset': header_position - self._stream.frame_position,
+            'size': tarinfo.size
+        }
+
+    def _write_zip(self, kind, name, data, mtime):
+        if kind == 'folder':
+            self._zip.mkdir(name)
+            return
+        zipinfo = zipfile.ZipInfo(name, date_time=max(time.localtime(mtime)[:6], (1980, 1, 1, 0, 0, 0)))
+        zipinfo.compress_type = zipfile.ZIP_DEFLATED
+        zipinfo.file_size = data.seek(0, 2)
+        data.seek(0)
+        with self._zip.open(zipinfo, 'w') as dest:
+            shutil.copyfileobj(data, dest)
+        self.index[name] = {'offset': zipinfo.header_offset, 'size': zipinfo.file_size}
+
+    @classmethod
+    def extract(cls, archive_path, name, destination):
+        # Copies one file out of an archive, using the index to go straight to it
+        with cls.get_index_path(archive_path).open() as f:
+            index = json.load(f)
+        entry = index['files'].get(name)
+        if entry is None:
+            raise KeyError(f"'{name}' is not in the archive.")
+        if 'link' in entry:
+            name = entry['link']
+            entry = index['files'][name]
+        if index['format'] == 'zip':
+            with zipfile.ZipFile(archive_path) as archive, archive.open(name) as source, open(destination, 'wb') as dest:
+                shutil.copyfileobj(source, dest)
+            return
+        with open(archive_path, 'rb') as fileobj:
+            fileobj.seek(entry['frame'])
+            with DECOMPRESSORS[index['format']](fileobj) as stream:
+                skip_bytes(stream, entry['offset'])
+                with tarfile.open(fileobj=stream, mode='r|') as tar:
+                    tarinfo = tar.next()
+                    with tar.extractfile(tarinfo) as source, open(destination, 'wb') as dest:
+                        shutil.copyfileobj(source, dest)
+
+    @classmethod
+    def list_files(cls, archive_path):
+        with cls.get_index_path(archive_path).open() as f:
+            index = json.load(f)
+        return index['files']
+
+class FrameWriter(object):
+    # A write only file that compresses what is written to it, end_frame() finishes the current
+    # compressed stream so reading can start again from the next one
+    def __init__(self, fileobj, new_compressor):
+        self.fileobj = fileobj
+        self.new_compressor = new_compressor
+        # Compressed offset and uncompressed position of the current frame
+        self.frame_offset = 0
+        self.frame_position = 0
+        self._position = 0
+        self._compressor = None
+
+    def write(self, data):
+        if self._compressor is None:
+            self._compressor = self.new_compressor()
+            self.frame_offset = self.fileobj.tell()
+            self.frame_position = self._position
+        self.fileobj.write(self._compressor.compress(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def frame_size(self):
+        return self._position - self.frame_position if self._compressor else 0
+
+    def end_frame(self):
+        if self._compressor is not None:
+            self.fileobj.write(self._compressor.flush())
+            self._compressor = None
+
+    def close(self):
+        self.end_frame()
+
+def skip_bytes(stream, count):
+    while count:
+        data = stream.read(min(count, 1024 * 1024))
+        if not data:
+            raise EOFError('The archive ended before the file was found, the index may not match the archive.')
+        count -= len(data)
+
+COMPRESSORS = {
+    'tar.gz': lambda: zlib.compressobj(6, zlib.DEFLATED, 31),
+    'tar.xz': lambda: lzma.LZMACompressor(),
+    'tar.zst': lambda: zstandard.ZstdCompressor(level=3).compressobj()
+}
+
+# Concatenated streams are valid in all of these formats, so the readers carry on across frames
+DECOMPRESSORS = {
+    'tar.gz': lambda fileobj: gzip.GzipFile(fileobj=fileobj, mode='rb'),
+    'tar.xz': lambda fileobj: lzma.LZMAFile(fileobj),
+    'tar.zst': lambda fileobj: zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+}
@@ -0,0 +1,94 @@
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class BackupCleanup(object):
+    # Removes what a backup no longer needs using the entry types os.scandir already has, so nothing
+    # is stat'ed, and deletes in batches spread over the workers. on_remove is called with the path
+    # of every removed item and whether it was a folder.
+    BATCH_SIZE = 64
+
+    def __init__(self, workers=1, on_remove=None):
+        self.workers = workers
+        self.on_remove = on_remove
+        self.removed_files = 0
+        self.removed_folders = 0
+        self.elapsed = 0.0
+
+    def clean_updated(self, expected_names):
+        # expected_names maps every folder in the backup to the names of the files and folders that
+        # belong in it, as they were named while downloading
+        start_time = time.monotonic()
+        removals = []
+        for folder_location, names in expected_names.items():
+            try:
+                with os.scandir(folder_location) as entries:
+                    for entry in entries:
+                        if entry.name not in names:
+                            removals.append((entry.path, entry.is_dir(follow_symlinks=False)))
+            except FileNotFoundError:
+                continue
+        self._remove(removals)
+        self.elapsed += time.monotonic() - start_time
+
+    def clean_incremental(self, save_destination, prev_save_destination):
+        # Post-order walk of the previous backup, a folder is removed once everything in it has been
+        # moved into the new backup. Children report whether they were kept through kept_folders.
+        start_time = time.monotonic()
+        kept_folders = {}
+        stack = [(os.fspath(save_destination), os.fspath(prev_save_destination), None)]
+        while stack:
+            destination, prev_destination, child_folders = stack.pop()
+            if child_folders is None:
+                child_folders = []
+                has_files = False
+                with os.scandir(prev_destination) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            child_folders.append(entry.name)
+                        else:
+                            has_files = True
+                if has_files:
+                    kept_folders[prev_destination] = True
+                stack.append((destination, prev_destination, child_folders))
+                stack.extend((os.path.join(destination, name), os.path.join(prev_destination, name), None) for name in child_folders)
+                continue
+
+            keep_directory = kept_folders.pop(prev_destination, False)
+            for name in child_folders:
+                keep_directory = kept_folders.pop(os.path.join(prev_destination, name)) or keep_directory
+
+            if not keep_directory:
+                if os.path.exists(destination):
+                    os.rmdir(prev_destination)
+                    self.removed_folders += 1
+                else:
+                    keep_directory = True
+            kept_folders[prev_destination] = keep_directory
+        self.elapsed += time.monotonic() - start_time
+
+    def _remove(self, removals):
+        batches = [removals[index:index + self.BATCH_SIZE] for index in range(0, len(removals), self.BATCH_SIZE)]
+        if self.workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cleanup') as executor:
+                results = list(executor.map(self._remove_batch, batches))
+        else:
+            results = [self._remove_batch(batch) for batch in batches]
+        for files, folders in results:
+            self.removed_files += files
+            self.removed_folders += folders
+
+    def _remove_batch(self, batch):
+        files = 0
+        folders = 0
+        for path, is_folder in batch:
+            if is_folder:
+                shutil.rmtree(path)
+                folders += 1
+            else:
+                os.unlink(path)
+                files += 1
+            if self.on_remove is not None:
+                self.on_remove(path, is_folder)
+        return (files, folders)
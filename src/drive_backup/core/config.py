@@ -4,6 +4,12 @@ import json, logging, sys
 
 DEFAULT_BACKUP_CONFIG = "drive-backup.bkp"
 DEFAULT_LOG = "drive-backup.log"
+LISTING_SUFFIX = ".listing.json"
+MANIFEST_SUFFIX = ".manifest.db"
+JOURNAL_SUFFIX = ".journal"
+STATS_SUFFIX = ".stats.json"
+EXPORT_CACHE_SUFFIX = ".export-cache"
+STORE_SUFFIX = ".store"
 
 
 class Config:
@@ -37,6 +43,8 @@ class Config:
         self.log_level = args.get("log_level", "INFO")
         self.log_filter = bool(args.get("log_filter", False))
         self.log_changes = bool(args.get("log_changes", False))
+        self.log_format = args.get("log_format", "text")
+        self.log_async = bool(args.get("log_async", False))
         if args.get("log_path"):
             self.log_path = Path(args["log_path"]).resolve()
             if self.log_path.is_dir():
@@ -44,14 +52,53 @@ class Config:
         else:
             self.log_path = None
         self.notifications = bool(args.get("notifications", True))
+        self.workers = int(args.get("workers", 1))
+        self.start_page_token = args.get("start_page_token")
+        self.manifest = bool(args.get("manifest", True))
+        self.change_detection = args.get("change_detection", "modified")
+        self.snapshot_mode = args.get("snapshot_mode", "copy")
+        self.resume = bool(args.get("resume", False))
+        self.dry_run = bool(args.get("dry_run", False))
+        self.plan_file = Path(args["plan_file"]).resolve() if args.get("plan_file") else None
+        self.max_requests_per_second = float(args["max_requests_per_second"]) if args.get("max_requests_per_second") else None
+        self.max_concurrent_requests = int(args["max_concurrent_requests"]) if args.get("max_concurrent_requests") else None
+        self.export_workers = int(args.get("export_workers", 1))
+        self.download_retries = int(args.get("download_retries", 5))
+        self.export_retries = int(args.get("export_retries", 5))
+        self.pipeline = bool(args.get("pipeline", False))
+        self.export_cache = bool(args.get("export_cache", False))
+        self.export_cache_size = int(args.get("export_cache_size", 1024))
+        self.store = args.get("store", "files")
+        self.archive = args.get("archive")
+        self.shared_drives = list(args.get("shared_drives", []))
         self.backup_date = datetime.fromisoformat(args["backup_date"]) if "backup_date" in args else None
 
     def set_config(self, args):
         self.update_values(args)
 
     def store_config(self):
-        path = self.backup_config or (self.destination / DEFAULT_BACKUP_CONFIG)
-        self.store_config_json(self.to_dict(), path)
+        self.store_config_json(self.to_dict(), self.get_config_path())
+
+    def get_config_path(self):
+        return self.backup_config or (self.destination / DEFAULT_BACKUP_CONFIG)
+
+    def get_listing_path(self):
+        return self.get_config_path().with_suffix(LISTING_SUFFIX)
+
+    def get_manifest_path(self):
+        return self.get_config_path().with_suffix(MANIFEST_SUFFIX)
+
+    def get_journal_path(self):
+        return self.get_config_path().with_suffix(JOURNAL_SUFFIX)
+
+    def get_stats_path(self):
+        return self.get_config_path().with_suffix(STATS_SUFFIX)
+
+    def get_export_cache_path(self):
+        return self.get_config_path().with_suffix(EXPORT_CACHE_SUFFIX)
+
+    def get_store_path(self):
+        return self.get_config_path().with_suffix(STORE_SUFFIX)
 
     def to_dict(self):
         return {
@@ -66,8 +113,26 @@ class Config:
             "log_level": self.log_level,
             "log_filter": int(self.log_filter),
             "log_changes": int(self.log_changes),
+            "log_format": self.log_format,
+            "log_async": int(self.log_async),
             "log_path": str(self.log_path) if self.log_path is not None else None,
             "notifications": int(self.notifications),
+            "workers": self.workers,
+            "start_page_token": self.start_page_token,
+            "manifest": int(self.manifest),
+            "change_detection": self.change_detection,
+            "snapshot_mode": self.snapshot_mode,
+            "max_requests_per_second": self.max_requests_per_second,
+            "max_concurrent_requests": self.max_concurrent_requests,
+            "export_workers": self.export_workers,
+            "download_retries": self.download_retries,
+            "export_retries": self.export_retries,
+            "pipeline": int(self.pipeline),
+            "export_cache": int(self.export_cache),
+            "export_cache_size": self.export_cache_size,
+            "store": self.store,
+            "archive": self.archive,
+            "shared_drives": self.shared_drives,
             "backup_date": datetime.now(timezone.utc).isoformat()
         }
 
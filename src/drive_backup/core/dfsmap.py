@@ -1,55 +1,167 @@
 import collections
+import sys
+from datetime import datetime, timezone
+
+class DriveFile(object):
+    # Sizes, versions and checksums are kept in their smallest form and converted
+    # back to the strings the Drive API uses when they are read
+    __slots__ = ('id', 'name', 'mimeType', '_modified_time', '_size', '_md5_checksum', 'headRevisionId', '_version', '_folders')
+    FIELDS = ('id', 'name', 'mimeType', 'modifiedTime', 'size', 'md5Checksum', 'headRevisionId', 'version')
+
+    def __init__(self, drive_object):
+        self.id = drive_object['id']
+        self.name = drive_object['name']
+        self.mimeType = sys.intern(drive_object['mimeType'])
+        self.modifiedTime = drive_object.get('modifiedTime')
+        self.size = drive_object.get('size')
+        self.md5Checksum = drive_object.get('md5Checksum')
+        self.headRevisionId = drive_object.get('headRevisionId')
+        self.version = drive_object.get('version')
+        self._folders = ()
+
+    @property
+    def modifiedTime(self):
+        if self._modified_time is None:
+            return None
+        modified_time = datetime.fromtimestamp(self._modified_time / 1000, timezone.utc)
+        return f"{modified_time.strftime('%Y-%m-%dT%H:%M:%S')}.{self._modified_time % 1000:03d}Z"
+
+    @modifiedTime.setter
+    def modifiedTime(self, value):
+        if value is None:
+            self._modified_time = None
+            return
+        modified_time = datetime.fromisoformat(value)
+        self._modified_time = round(modified_time.timestamp() * 1000)
+
+    @property
+    def size(self):
+        return str(self._size) if self._size is not None else None
+
+    @size.setter
+    def size(self, value):
+        self._size = int(value) if value is not None else None
+
+    @property
+    def md5Checksum(self):
+        return self._md5_checksum.hex() if self._md5_checksum is not None else None
+
+    @md5Checksum.setter
+    def md5Checksum(self, value):
+        self._md5_checksum = bytes.fromhex(value) if value is not None else None
+
+    @property
+    def version(self):
+        return str(self._version) if self._version is not None else None
+
+    @version.setter
+    def version(self, value):
+        self._version = int(value) if value is not None else None
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in self.FIELDS else None
+        return default if value is None else value
+
+    def copy(self):
+        drive_file = DriveFile.__new__(DriveFile)
+        for field in self.__slots__:
+            setattr(drive_file, field, getattr(self, field))
+        return drive_file
+
+class DriveFolder(object):
+    __slots__ = ('id', 'name', 'files', 'folders', 'temp', '_parents')
+
+    def __init__(self, folder_id, name, temp=False):
+        self.id = folder_id
+        self.name = name
+        self.files = []
+        self.folders = []
+        self.temp = temp
+        self._parents = ()
+
+    def iter_files(self):
+        # Shortcuts placed next to their target share its id, only the first one is kept
+        if len(self.files) < 2:
+            yield from self.files
+            return
+        file_ids = set()
+        for drive_file in self.files:
+            if drive_file.id not in file_ids:
+                file_ids.add(drive_file.id)
+                yield drive_file
 
 class DriveFileSystemMap(object):
-    Drive_folder_object = collections.namedtuple('Drive_folder_object',['name', 'files', 'folders', 'temp'])
+    Walk_item = collections.namedtuple('Walk_item', ['path', 'folder', 'files', 'folders'])
+    Stream_names = collections.namedtuple('Stream_names', ['file_names', 'file_ids', 'folder_names', 'files', 'folders'])
 
     def __init__(self, root_folder):
-        self._file_system_map = {root_folder['id']: self.Drive_folder_object(root_folder['name'], {}, {}, False)}
+        self._file_system_map = {root_folder['id']: DriveFolder(root_folder['id'], root_folder['name'])}
         self._total_folders = -1
         self._total_files = -1
+        self._total_bytes = -1
         self.root_folder_id = root_folder['id']
+        self._stream_items = None
 
     def add_file(self, drive_object):
         self._total_folders = -1
         self._total_files = -1
+        self._total_bytes = -1
         if 'parents' in drive_object:
+            drive_file = DriveFile(drive_object)
             for parentID in drive_object['parents']:
-                drive_folder = self._file_system_map.get(parentID)
-                if not drive_folder:
-                    self._file_system_map[parentID] = self._get_temp_folder_object()
-                    drive_folder = self._file_system_map[parentID]
-                if drive_object['id'] not in drive_folder.files:
-                    drive_folder.files[drive_object['id']] = drive_object
+                drive_folder = self._get_or_add_temp_folder(parentID)
+                if parentID not in drive_file._folders:
+                    drive_file._folders += (parentID,)
+                    drive_folder.files.append(drive_file)
+                    if self._stream_items is not None:
+                        self._stream_file(drive_folder, drive_file)
 
     def add_folder(self, drive_object):
         self._total_folders = -1
         self._total_files = -1
+        self._total_bytes = -1
         if 'parents' in drive_object:
-            if drive_object['id'] not in self._file_system_map:
-                drive_folder = self.Drive_folder_object(drive_object['name'], {}, {}, False)
+            drive_folder = self._file_system_map.get(drive_object['id'])
+            if drive_folder is None:
+                drive_folder = DriveFolder(drive_object['id'], drive_object['name'])
                 self._file_system_map[drive_object['id']] = drive_folder
-                self._add_to_parents(drive_object)
-            elif self._is_temporary_folder(drive_object['id']):
-                permanent_folder = self._get_perm_folder_object(drive_object)
-                self._file_system_map[drive_object['id']] = permanent_folder
-                self._add_to_parents(drive_object)
-
-    def _add_to_parents(self, drive_object):
-        for parentID in drive_object['parents']:
-            parent_folder = self._file_system_map.get(parentID)
-            if not parent_folder:
-                self._file_system_map[parentID] = self._get_temp_folder_object()
-                parent_folder = self._file_system_map[parentID]
-            if drive_object['id'] not in parent_folder.folders:
-                parent_folder.folders[drive_object['id']] = drive_object
+                self._add_to_parents(drive_folder, drive_object['parents'])
+            elif drive_folder.temp:
+                drive_folder.name = drive_object['name']
+                drive_folder.temp = False
+                self._add_to_parents(drive_folder, drive_object['parents'])
+
+    def _add_to_parents(self, drive_folder, parent_ids):
+        for parentID in parent_ids:
+            parent_folder = self._get_or_add_temp_folder(parentID)
+            if parentID not in drive_folder._parents:
+                drive_folder._parents += (parentID,)
+                parent_folder.folders.append(drive_folder)
+                if self._stream_items is not None:
+                    self._stream_folder(parent_folder, drive_folder)
+
+    def _get_or_add_temp_folder(self, folder_id):
+        drive_folder = self._file_system_map.get(folder_id)
+        if drive_folder is None:
+            drive_folder = DriveFolder(folder_id, 'TEMP', temp=True)
+            self._file_system_map[folder_id] = drive_folder
+        return drive_folder
 
     def get_folder(self, folder_id):
         return self._file_system_map.get(folder_id)
 
     def set_folder_name(self, folder_id, new_name):
-        folder = self._file_system_map.get(folder_id)
-        new_folder = folder._replace(name=new_name)
-        self._file_system_map[folder_id] = new_folder
+        self._file_system_map[folder_id].name = new_name
 
     def get_root_folder(self):
         return self._file_system_map.get(self.root_folder_id)
@@ -64,24 +176,111 @@ class DriveFileSystemMap(object):
             self._update_totals()
         return self._total_files
 
-    def _get_temp_folder_object(self):
-        return self.Drive_folder_object('TEMP', {}, {}, True)
+    def get_total_bytes(self):
+        if self._total_bytes == -1:
+            self._update_totals()
+        return self._total_bytes
+
+    def _update_totals(self):
+        self._total_folders = 0
+        self._total_files = 0
+        self._total_bytes = 0
+        for item in self.walk():
+            self._total_folders += 1
+            self._total_files += len(item.files)
+            self._total_bytes += sum(drive_file._size or 0 for drive_file in item.files)
 
-    def _get_perm_folder_object(self, folder_object):
-        temp_folder = self._file_system_map[folder_object['id']]
-        return temp_folder._replace(name=folder_object['name'], temp=False)
+    def walk(self, rename=None):
+        # Iterative pre-order walk yielding a work item per folder, deep trees never touch the
+        # recursion limit. When rename is given duplicate names in a folder are renamed with it,
+        # the shared records are left alone and renamed files are yielded as copies.
+        root_folder = self.get_root_folder()
+        stack = [((root_folder.name,), root_folder)]
+        while stack:
+            path, drive_folder = stack.pop()
+            folders = self._resolve_names(drive_folder.folders, rename)
+            files = self._resolve_names(drive_folder.iter_files(), rename)
+            yield self.Walk_item(path, drive_folder, [drive_file for _, drive_file in files], tuple(name for name, _ in folders))
+            stack.extend((path + (name,), folder) for name, folder in reversed(folders))
 
-    def _is_temporary_folder(self, folder_id):
-        return self._file_system_map[folder_id].temp
+    def _resolve_names(self, items, rename):
+        resolved = []
+        names = set()
+        for item in items:
+            name = item.name
+            if rename is not None:
+                while name in names:
+                    name = rename(name)
+                names.add(name)
+                if name != item.name and isinstance(item, DriveFile):
+                    item = item.copy()
+                    item.name = name
+            resolved.append((name, item))
+        return resolved
 
-    def _update_totals(self):
-        self._total_folders, self._total_files = self._count_totals(self.get_root_folder())
-
-    def _count_totals(self, drive_folder_object):
-        drive_folder_cnt = 1
-        drive_file_cnt = len(drive_folder_object.files)
-        for folder in drive_folder_object.folders.values():
-            folder_cnt, file_cnt = self._count_totals(self.get_folder(folder['id']))
-            drive_folder_cnt += folder_cnt
-            drive_file_cnt += file_cnt
-        return (drive_folder_cnt, drive_file_cnt)
+    def start_streaming(self, rename=None):
+        # While streaming, everything added to the map is queued as a work item as soon as the path of
+        # its folder is known. Names resolve in the order items are added, the same order walk() uses,
+        # so a walk over the finished map matches the streamed items.
+        root_folder = self.get_root_folder()
+        self._stream_rename = rename
+        self._stream_items = collections.deque()
+        self._stream_paths = {}
+        self._stream_names = {}
+        self._assign_stream_path(root_folder, (root_folder.name,))
+
+    def pop_stream_items(self):
+        items = list(self._stream_items)
+        self._stream_items.clear()
+        return items
+
+    def stop_streaming(self):
+        self._stream_items = None
+        self._stream_paths = None
+        self._stream_names = None
+
+    def _get_stream_names(self, folder_id):
+        stream_names = self._stream_names.get(folder_id)
+        if stream_names is None:
+            stream_names = self.Stream_names(set(), set(), set(), [], [])
+            self._stream_names[folder_id] = stream_names
+        return stream_names
+
+    def _resolve_stream_name(self, name, names):
+        if self._stream_rename is not None:
+            while name in names:
+                name = self._stream_rename(name)
+            names.add(name)
+        return name
+
+    def _stream_file(self, drive_folder, drive_file):
+        stream_names = self._get_stream_names(drive_folder.id)
+        if drive_file.id in stream_names.file_ids:
+            return
+        stream_names.file_ids.add(drive_file.id)
+        name = self._resolve_stream_name(drive_file.name, stream_names.file_names)
+        if name != drive_file.name:
+            drive_file = drive_file.copy()
+            drive_file.name = name
+        stream_names.files.append(drive_file)
+        for path in self._stream_paths.get(drive_folder.id, ()):
+            self._stream_items.append(self.Walk_item(path, drive_folder, [drive_file], ()))
+
+    def _stream_folder(self, parent_folder, drive_folder):
+        stream_names = self._get_stream_names(parent_folder.id)
+        name = self._resolve_stream_name(drive_folder.name, stream_names.folder_names)
+        stream_names.folders.append((name, drive_folder))
+        for path in self._stream_paths.get(parent_folder.id, ()):
+            self._assign_stream_path(drive_folder, path + (name,))
+
+    def _assign_stream_path(self, drive_folder, path):
+        stack = [(path, drive_folder)]
+        while stack:
+            path, drive_folder = stack.pop()
+            self._stream_paths.setdefault(drive_folder.id, []).append(path)
+            stream_names = self._stream_names.get(drive_folder.id)
+            if stream_names is None:
+                self._stream_items.append(self.Walk_item(path, drive_folder, [], ()))
+                continue
+            self._stream_items.append(self.Walk_item(path, drive_folder, list(stream_names.files), tuple(name for name, _ in stream_names.folders)))
+            stack.extend((path + (name,), folder) for name, folder in reversed(stream_names.folders))
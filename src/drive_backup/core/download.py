@@ -0,0 +1,72 @@
+import threading
+import time
+from googleapiclient.http import MediaIoBaseDownload
+
+MIN_CHUNKSIZE = 256*1024
+MAX_CHUNKSIZE = 64*1024*1024
+DEFAULT_CHUNKSIZE = 1024*1024
+# Aim for each chunk request to take about this long
+TARGET_CHUNK_SECONDS = 2
+
+class ChunkedDownload(MediaIoBaseDownload):
+    def __init__(self, fd, request, file_size=None, offset=0):
+        super().__init__(fd, request, chunksize=initial_chunksize(file_size))
+        self._progress = offset
+
+    @property
+    def progress(self):
+        return self._progress
+
+    @property
+    def chunksize(self):
+        return self._chunksize
+
+    def next_chunk(self, num_retries=0):
+        start_progress = self._progress
+        start_time = time.monotonic()
+        status, done = super().next_chunk(num_retries=num_retries)
+        self._adapt_chunksize(self._progress - start_progress, time.monotonic() - start_time)
+        return status, done
+
+    def _adapt_chunksize(self, chunk_bytes, seconds):
+        if chunk_bytes < self._chunksize or seconds <= 0:
+            return
+        throughput = chunk_bytes / seconds
+        self._chunksize = clamp_chunksize(throughput * TARGET_CHUNK_SECONDS)
+
+def initial_chunksize(file_size):
+    if file_size is None:
+        return DEFAULT_CHUNKSIZE
+    return max(DEFAULT_CHUNKSIZE, clamp_chunksize(file_size // 8))
+
+def clamp_chunksize(chunksize):
+    chunksize = int(chunksize) // MIN_CHUNKSIZE * MIN_CHUNKSIZE
+    return max(MIN_CHUNKSIZE, min(chunksize, MAX_CHUNKSIZE))
+
+class DownloadTracker(object):
+    # Makes sure a file that shows up in several places is fetched once. The first job to claim a key
+    # fetches it, later jobs wait for it to finish and get the path it was saved to.
+    def __init__(self):
+        self._downloads = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        while True:
+            with self._lock:
+                download = self._downloads.get(key)
+                if download is None:
+                    self._downloads[key] = threading.Event()
+                    return None
+                if not isinstance(download, threading.Event):
+                    return download
+            download.wait()
+
+    def finish(self, key, path):
+        with self._lock:
+            event = self._downloads[key]
+            # A failed download gives up its claim, the next job waiting on it tries again
+            if path is None:
+                del self._downloads[key]
+            else:
+                self._downloads[key] = path
+        event.set()
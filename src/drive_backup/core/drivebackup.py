@@ -7,8 +7,25 @@ import time
 import calendar
 import shutil
 import json
+import collections
+import copy
+import hashlib
+import itertools
+import threading
+import queue
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from . import DriveFileSystemMap
+from . import DriveFileSystemMap, BackupManifest, BackupJournal
+from . import snapshot_file
+from . import ChunkedDownload, DownloadTracker
+from . import RequestScheduler
+from . import BackupStats
+from . import BackupCleanup
+from . import ExportCache
+from . import ContentStore
+from . import BackupPlan
+from . import BackupArchive
 from . import config, DEFAULT_LOG
 from . import show_notification
 from . import progress
@@ -20,7 +37,7 @@ from pathvalidate import sanitize_filename, validate_filename, ValidationError
 
 from googleapiclient import discovery
 from googleapiclient import errors
-from googleapiclient.http import MediaIoBaseDownload
+import httplib2
 
 APPLICATION_NAME = 'Drive Backup'
 MIME_TYPES = {
@@ -37,22 +54,62 @@ FILE_EXTENSIONS = {
     'application/pdf': 'pdf',
     'application/vnd.google-apps.script+json': 'json'
 }
+LISTING_FIELDS = 'id, name, mimeType, modifiedTime, parents, shortcutDetails, size, md5Checksum, headRevisionId, version'
+LISTING_BATCH_SIZE = 30
+PART_SUFFIX = '.part'
+SHORTCUT_TARGET_FIELDS = ('modifiedTime', 'size', 'md5Checksum', 'headRevisionId', 'version')
+SHARED_DRIVES_FOLDER = 'Shared drives'
+SHARED_DRIVE_LISTING_WORKERS = 8
 
 drive_file_system = None
+shared_drive_maps = []
 download_errors = 0
+export_errors = 0
+credentials = None
+manifest = None
+journal = None
+scheduler = RequestScheduler()
+planned_actions = None
+stats = BackupStats()
+log_listener = None
+expected_names = None
+download_tracker = DownloadTracker()
+export_cache = None
+content_store = None
+archive = None
+client_options = None
+shared_request_slots = None
+thread_data = threading.local()
+prompt_lock = threading.Lock()
+# Set when the backup is stopping, download workers stop at their next chunk
+backup_stopping = threading.Event()
+downloading = False
+
+class BackupStopped(Exception):
+    # Raised by stop_backup while other threads are still working on the backup, the main thread
+    # stops the backup once they have finished
+    pass
+
+def get_service():
+    service = getattr(thread_data, 'service', None)
+    if service is None:
+        with stats.thread_phase('discovery'):
+            service = discovery.build('drive', 'v3', credentials=credentials, client_options=client_options)
+        thread_data.service = service
+    return service
 
 def get_source_folder():
     logger = logging.getLogger(__name__)
     if config.source:
         try:
-            results = service.files().list(fields="files(id, name, mimeType)", q=f"'root' in parents and name='{config.source}' and trashed=false").execute()
+            results = scheduler.execute(get_service().files().list(fields="files(id, name, mimeType)", q=f"'root' in parents and name='{config.source}' and trashed=false"))
         except:
             logger.critical('Error initiating backup.', exc_info=True)
             stop_backup()
         items = results.get('files', [])
     else:
         try:
-            results = service.files().get(fields="id, name, mimeType", fileId=config.source_id).execute()
+            results = scheduler.execute(get_service().files().get(fields="id, name, mimeType", fileId=config.source_id))
         except:
             logger.critical('Error initiating backup.', exc_info=True)
             stop_backup()
@@ -76,7 +133,7 @@ def get_source_folder():
 
     return None
 
-def get_save_destination():
+def get_backup_destinations():
     parent_destination = config.destination
     if config.backup_name:
         try:
@@ -94,6 +151,13 @@ def get_save_destination():
 
     save_destination = parent_destination / backup_name
     recent_backup_destination = get_recent_backup(parent_destination, backup_name)
+    return (save_destination, recent_backup_destination)
+
+def get_save_destination():
+    save_destination, recent_backup_destination = get_backup_destinations()
+    if config.archive:
+        # Nothing is written to the backup folder, its files go straight into the archive
+        return (save_destination, None)
 
     if not save_destination.exists():
         if config.backup_type == 'complete' or config.backup_type == 'increment':
@@ -101,6 +165,8 @@ def get_save_destination():
         elif config.backup_type == 'update':
             if recent_backup_destination:
                 recent_backup_destination.rename(save_destination)
+                if manifest:
+                    manifest.rename_backup(recent_backup_destination.name, save_destination.name)
             else:
                 save_destination.mkdir(parents=True)
 
@@ -138,171 +204,868 @@ def get_recent_backup(directory, current_backup):
             return None
 
 
-def build_dfsmap(source_folder):
-    logger = logging.getLogger(__name__)
+def build_dfsmap(source_folder, drive_listing):
     drive_file_system = DriveFileSystemMap(source_folder)
+    scope_ids = None
+    if drive_listing.get('source_id'):
+        scope_ids = get_scope_folder_ids(drive_listing)
+    shortcut_targets = collections.ChainMap(drive_listing.get('shortcut_targets', {}), drive_listing['files'])
+    # Scoped listings aren't ordered folders first, a shortcut added before the folder it points
+    # to would take the folder's place in the map
+    for object in sorted(drive_listing['files'].values(), key=lambda object: object['mimeType'] != 'application/vnd.google-apps.folder'):
+        object = dict(object)
+        if scope_ids is not None:
+            object['parents'] = [parent_id for parent_id in object.get('parents', []) if parent_id in scope_ids]
+        add_drive_object(drive_file_system, object, shortcut_targets)
+    return drive_file_system
 
+def add_drive_object(drive_file_system, object, shortcut_targets=None):
+    object['name'] = sanitize(object['name'])
+    if object['mimeType'] == 'application/vnd.google-apps.shortcut':
+        object['id'] = object['shortcutDetails']['targetId']
+        object['mimeType'] = object['shortcutDetails']['targetMimeType']
+        # A shortcut is saved as its target, so it is checked for changes and fetched like the target
+        target = shortcut_targets.get(object['id']) if shortcut_targets is not None else None
+        if target is not None:
+            for field in SHORTCUT_TARGET_FIELDS:
+                object[field] = target.get(field)
+    if object['mimeType'] == 'application/vnd.google-apps.folder':
+        drive_file_system.add_folder(object)
+    else:
+        drive_file_system.add_file(object)
+
+def get_drive_listing(user_info, source_folder, on_objects=None):
+    logger = logging.getLogger(__name__)
+    user = user_info['user']['emailAddress']
+    source_id = source_folder['id'] if is_source_scoped() else None
+    drive_listing = load_drive_listing(user, source_id)
+
+    # Each shared drive is listed on its own thread while My Drive is listed
+    shared_drives = get_shared_drives()
+    shared_drive_listings = []
+    if shared_drives:
+        previous_listings = {listing['drive_id']: listing for listing in drive_listing.get('shared_drives', [])} if drive_listing else {}
+        shared_drive_executor = ThreadPoolExecutor(max_workers=min(len(shared_drives), SHARED_DRIVE_LISTING_WORKERS), thread_name_prefix='shared-drive')
+        shared_drive_listings = [shared_drive_executor.submit(get_shared_drive_listing, shared_drive, previous_listings.get(shared_drive['id'])) for shared_drive in shared_drives]
+        shared_drive_executor.shutdown(wait=False)
+
+    if drive_listing is not None:
+        try:
+            apply_drive_changes(drive_listing)
+            logger.info(f"Applied Drive changes to the previous listing, {len(drive_listing['files'])} items")
+        except errors.HttpError:
+            logger.warning('Could not get Drive changes, the start page token may have expired. Listing all files again.', exc_info=True)
+            drive_listing = None
+
+    if drive_listing is None:
+        start_page_token = scheduler.execute(get_service().changes().getStartPageToken())['startPageToken']
+        drive_listing = {
+            'user': user,
+            'start_page_token': start_page_token,
+            'source_id': source_id,
+            'fields': LISTING_FIELDS,
+            'files': list_source_files([source_id], on_objects) if source_id else list_drive_files(on_objects)
+        }
+    drive_listing['shortcut_targets'] = get_shortcut_targets(drive_listing['files'])
+    drive_listing['shared_drives'] = [future.result() for future in shared_drive_listings]
+    return drive_listing
+
+def get_shared_drives():
+    # The shared drives picked with --shared-drive by name or id, 'all' picks every shared drive
+    logger = logging.getLogger(__name__)
+    if not config.shared_drives:
+        return []
+    shared_drives = []
     next_page_token = None
     while True:
-        results = service.files().list(pageSize=1000,
-                                       fields="nextPageToken, files(id, name, mimeType, modifiedTime, parents, shortcutDetails, size)",
-                                       q=u"trashed=false",
-                                       pageToken=next_page_token,
-                                       orderBy='folder desc').execute(num_retries=5)
+        results = scheduler.execute(get_service().drives().list(pageSize=100, fields='nextPageToken, drives(id, name)', pageToken=next_page_token))
+        shared_drives.extend(results.get('drives', []))
+        next_page_token = results.get('nextPageToken')
+        if next_page_token is None:
+            break
+
+    if 'all' in config.shared_drives:
+        return shared_drives
+    selected = [shared_drive for shared_drive in shared_drives if shared_drive['id'] in config.shared_drives or shared_drive['name'] in config.shared_drives]
+    found = {shared_drive['id'] for shared_drive in selected} | {shared_drive['name'] for shared_drive in selected}
+    for name in config.shared_drives:
+        if name not in found:
+            logger.warning(f"Shared drive '{name}' was not found, it will not be backed up.")
+    return selected
+
+def get_shared_drive_listing(shared_drive, drive_listing=None):
+    logger = logging.getLogger(__name__)
+    if drive_listing is not None and drive_listing.get('fields') == LISTING_FIELDS:
+        try:
+            apply_drive_changes(drive_listing)
+            logger.info(f"Applied changes to the previous listing of shared drive '{shared_drive['name']}', {len(drive_listing['files'])} items")
+        except errors.HttpError:
+            logger.warning(f"Could not get the changes of shared drive '{shared_drive['name']}'. Listing all of its files again.", exc_info=True)
+            drive_listing = None
+    else:
+        drive_listing = None
+
+    if drive_listing is None:
+        start_page_token = scheduler.execute(get_service().changes().getStartPageToken(driveId=shared_drive['id'], supportsAllDrives=True))['startPageToken']
+        drive_listing = {
+            'drive_id': shared_drive['id'],
+            'start_page_token': start_page_token,
+            'fields': LISTING_FIELDS,
+            'files': list_drive_files(drive_id=shared_drive['id'])
+        }
+    drive_listing['name'] = shared_drive['name']
+    drive_listing['shortcut_targets'] = get_shortcut_targets(drive_listing['files'])
+    return drive_listing
+
+def build_shared_drive_maps(drive_listing):
+    # Every shared drive has a map of its own, saved in SHARED_DRIVES_FOLDER under the drive's name
+    file_systems = []
+    names = set()
+    for shared_drive_listing in drive_listing.get('shared_drives', []):
+        name = sanitize(shared_drive_listing['name'])
+        while name in names:
+            name = change_name(name)
+        names.add(name)
+        file_systems.append(build_dfsmap({'id': shared_drive_listing['drive_id'], 'name': name}, shared_drive_listing))
+    return file_systems
+
+def walk_backup():
+    # Work items for My Drive, then for every shared drive
+    yield from drive_file_system.walk(rename=change_name)
+    yield from walk_shared_drives()
+
+def walk_shared_drives():
+    for shared_drive_map in shared_drive_maps:
+        for item in shared_drive_map.walk(rename=change_name):
+            yield item._replace(path=(SHARED_DRIVES_FOLDER,) + item.path)
+
+def set_progress_totals():
+    file_systems = [drive_file_system, *shared_drive_maps]
+    progress.total_bytes = sum(file_system.get_total_bytes() for file_system in file_systems)
+    progress.total_files = sum(file_system.get_total_files() for file_system in file_systems)
+    progress.total_folders = sum(file_system.get_total_folders() for file_system in file_systems)
+
+def get_shortcut_targets(drive_files):
+    # Shortcuts to files outside of what was listed are looked up one by one
+    logger = logging.getLogger(__name__)
+    target_ids = {
+        object['shortcutDetails']['targetId'] for object in drive_files.values()
+        if object['mimeType'] == 'application/vnd.google-apps.shortcut'
+        and object['shortcutDetails'].get('targetMimeType') != 'application/vnd.google-apps.folder'
+        and object['shortcutDetails']['targetId'] not in drive_files
+    }
+    if not target_ids:
+        return {}
+
+    def get_target(target_id):
+        try:
+            return scheduler.execute(get_service().files().get(fileId=target_id, fields=LISTING_FIELDS, supportsAllDrives=True))
+        except errors.HttpError:
+            logger.info(f'Could not get the target of a shortcut ({target_id}), it will be backed up with the shortcut\'s details.', exc_info=True)
+            return None
+
+    with ThreadPoolExecutor(max_workers=config.workers, thread_name_prefix='list') as executor:
+        targets = executor.map(get_target, target_ids)
+    return {target['id']: target for target in targets if target is not None}
+
+def is_source_scoped():
+    return bool(config.source) or config.source_id != 'root'
+
+def list_drive_files(on_objects=None, drive_id=None):
+    # Lists My Drive, or the shared drive drive_id
+    logger = logging.getLogger(__name__)
+    drive_args = {'corpora': 'drive', 'driveId': drive_id, 'includeItemsFromAllDrives': True, 'supportsAllDrives': True} if drive_id else {}
+    drive_files = {}
+    next_page_token = None
+    while True:
+        results = scheduler.execute(get_service().files().list(pageSize=1000,
+                                                               fields=f"nextPageToken, files({LISTING_FIELDS})",
+                                                               q=u"trashed=false",
+                                                               pageToken=next_page_token,
+                                                               orderBy='folder desc',
+                                                               **drive_args))
         if not results:
             logger.error('Could not prepare the backup successfully. Check the log for more details.')
             results = {}
         for object in results.get('files', []):
-            object['name'] = sanitize(object['name'])
-            if object['mimeType'] == 'application/vnd.google-apps.shortcut':
-                object['id'] = object['shortcutDetails']['targetId']
-                object['mimeType'] = object['shortcutDetails']['targetMimeType']
-            if object['mimeType'] == 'application/vnd.google-apps.folder':
-                drive_file_system.add_folder(object)
-            else:
-                drive_file_system.add_file(object)
+            drive_files[object['id']] = object
+        if on_objects:
+            on_objects(results.get('files', []))
 
         next_page_token = results.get('nextPageToken')
         if next_page_token is None:
             break
 
-    return drive_file_system
+    return drive_files
 
-
-def get_folder(parent_dest, prev_parent_dest=None, drive_folder_object=None):
-    global download_errors
+def list_source_files(folder_ids, on_objects=None):
+    drive_files = {}
+    listed_folder_ids = set(folder_ids)
+    folder_ids = list(folder_ids)
+    pending = set()
+    executor = ThreadPoolExecutor(max_workers=config.workers, thread_name_prefix='list')
+    try:
+        while folder_ids or pending:
+            while folder_ids and len(pending) < config.workers:
+                batch = folder_ids[:LISTING_BATCH_SIZE]
+                del folder_ids[:LISTING_BATCH_SIZE]
+                pending.add(executor.submit(list_folder_children, batch))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                new_objects = []
+                for object in future.result():
+                    if object['id'] in drive_files:
+                        continue
+                    drive_files[object['id']] = object
+                    new_objects.append(object)
+                    folder_id = get_listing_folder_id(object)
+                    if folder_id and folder_id not in listed_folder_ids:
+                        listed_folder_ids.add(folder_id)
+                        folder_ids.append(folder_id)
+                if on_objects:
+                    on_objects(new_objects)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return drive_files
+
+def list_folder_children(folder_ids):
     logger = logging.getLogger(__name__)
-    if not drive_folder_object:
-        drive_folder_object = drive_file_system.get_root_folder()
+    parents_query = ' or '.join(f"'{folder_id}' in parents" for folder_id in folder_ids)
+    children = []
+    next_page_token = None
+    while True:
+        results = scheduler.execute(get_service().files().list(pageSize=1000,
+                                                               fields=f"nextPageToken, files({LISTING_FIELDS})",
+                                                               q=f"({parents_query}) and trashed=false",
+                                                               pageToken=next_page_token))
+        if not results:
+            logger.error('Could not prepare the backup successfully. Check the log for more details.')
+            results = {}
+        children.extend(results.get('files', []))
 
-    folder_location = parent_dest / drive_folder_object.name
-    prev_folder_location = None
-    if prev_parent_dest:
-        prev_folder_location = prev_parent_dest / drive_folder_object.name
+        next_page_token = results.get('nextPageToken')
+        if next_page_token is None:
+            break
 
-    if not folder_location.exists():
-        try:
-            folder_location.mkdir(parents=True)
-        except:
-            logger.critical(f'Could not create folder: {folder_location}', exc_info=True)
-            stop_backup()
-        logger.info(f'{folder_location} : Folder Created')
+    return children
+
+def get_listing_folder_id(object):
+    if object['mimeType'] == 'application/vnd.google-apps.folder':
+        return object['id']
+    if object['mimeType'] == 'application/vnd.google-apps.shortcut' and object['shortcutDetails'].get('targetMimeType') == 'application/vnd.google-apps.folder':
+        return object['shortcutDetails']['targetId']
+    return None
 
+def get_scope_folder_ids(drive_listing):
+    scope_ids = {drive_listing['source_id']}
+    for object in drive_listing['files'].values():
+        folder_id = get_listing_folder_id(object)
+        if folder_id:
+            scope_ids.add(folder_id)
+    return scope_ids
+
+def apply_drive_changes(drive_listing):
+    logger = logging.getLogger(__name__)
+    drive_files = drive_listing['files']
+    previous_ids = set(drive_files)
+    page_token = drive_listing['start_page_token']
+    drive_id = drive_listing.get('drive_id')
+    drive_args = {'driveId': drive_id, 'includeItemsFromAllDrives': True, 'supportsAllDrives': True} if drive_id else {}
+    change_cnt = 0
+    while page_token is not None:
+        results = scheduler.execute(get_service().changes().list(pageSize=1000,
+                                                                 fields=f"nextPageToken, newStartPageToken, changes(changeType, fileId, removed, file({LISTING_FIELDS}, trashed))",
+                                                                 pageToken=page_token,
+                                                                 includeRemoved=True,
+                                                                 **drive_args))
+        for change in results.get('changes', []):
+            # Changes to shared drives themselves have no fileId
+            if change.get('changeType', 'file') != 'file' or 'fileId' not in change:
+                continue
+            change_cnt += 1
+            drive_file = change.get('file')
+            if change.get('removed') or not drive_file or drive_file.pop('trashed', False):
+                drive_files.pop(change['fileId'], None)
+            else:
+                drive_files[change['fileId']] = drive_file
+
+        page_token = results.get('nextPageToken')
+        if 'newStartPageToken' in results:
+            drive_listing['start_page_token'] = results['newStartPageToken']
+    logger.info(f'{change_cnt} Drive changes since the previous backup')
+
+    if drive_listing.get('source_id'):
+        scope_drive_changes(drive_listing, previous_ids)
+
+def scope_drive_changes(drive_listing, previous_ids):
+    drive_files = drive_listing['files']
+    children = {}
+    for object in drive_files.values():
+        for parent_id in object.get('parents', []):
+            children.setdefault(parent_id, []).append(object)
+
+    in_scope = {}
+    new_folder_ids = []
+    folder_ids = [drive_listing['source_id']]
+    visited_folder_ids = set(folder_ids)
+    while folder_ids:
+        for object in children.get(folder_ids.pop(), []):
+            in_scope[object['id']] = object
+            folder_id = get_listing_folder_id(object)
+            if folder_id and folder_id not in visited_folder_ids:
+                visited_folder_ids.add(folder_id)
+                folder_ids.append(folder_id)
+                if object['id'] not in previous_ids:
+                    new_folder_ids.append(folder_id)
+
+    # Changes only report a folder moved into the source, not its contents
+    if new_folder_ids:
+        for object_id, object in list_source_files(new_folder_ids).items():
+            in_scope.setdefault(object_id, object)
+    drive_listing['files'] = in_scope
+
+def load_drive_listing(user, source_id):
+    logger = logging.getLogger(__name__)
+    if not config.start_page_token:
+        return None
+    listing_path = config.get_listing_path()
+    try:
+        with listing_path.open(encoding='utf-8') as f:
+            drive_listing = json.load(f)
+    except FileNotFoundError:
+        logger.info(f"Drive listing '{listing_path}' not found. Listing all files again.")
+        return None
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        logger.warning(f"Drive listing '{listing_path}' is corrupted. Listing all files again.")
+        return None
+    if (drive_listing.get('user') != user or drive_listing.get('source_id') != source_id or
+        drive_listing.get('fields') != LISTING_FIELDS or drive_listing.get('start_page_token') != config.start_page_token):
+        logger.info('Drive listing does not match this backup. Listing all files again.')
+        return None
+    return drive_listing
+
+def stage_drive_listing(drive_listing):
+    # The listing is written out once the map is built, so it isn't kept in memory next to the map
+    # while files download. It replaces the stored listing when the backup completes.
+    with get_staged_listing_path().open('w', encoding='utf-8') as f:
+        json.dump(drive_listing, f)
+    return drive_listing['start_page_token']
+
+def store_drive_listing(start_page_token):
+    get_staged_listing_path().replace(config.get_listing_path())
+    config.start_page_token = start_page_token
+
+def get_staged_listing_path():
+    listing_path = config.get_listing_path()
+    return listing_path.with_name(listing_path.name + PART_SUFFIX)
+
+
+def get_folder(parent_dest, prev_parent_dest=None, work_items=None):
+    file_jobs = plan_folder(parent_dest, prev_parent_dest, work_items)
+    if config.workers > 1:
+        download_files_concurrently(file_jobs)
+    else:
+        for drive_file, folder_location, prev_folder_location, file_name in file_jobs:
+            file_location = get_file(drive_file, folder_location, prev_folder_location, file_name)
+            handle_file_result(file_location, drive_file)
 
-    file_names = set()
-    for file in drive_folder_object.files.values():
-        if file['name'] in file_names:
-            file['name'] = change_name(file['name'])
-        file_names.add(file['name'])
+def plan_folder(parent_dest, prev_parent_dest=None, work_items=None):
+    logger = logging.getLogger(__name__)
+    if work_items is None:
+        work_items = walk_backup()
+    # A streamed folder can come back in later work items with files listed after it
+    planned_folders = set()
+    for folder_path, _, files, folder_names in work_items:
+        folder_location = parent_dest.joinpath(*folder_path)
+        prev_folder_location = None
+        if prev_parent_dest:
+            prev_folder_location = prev_parent_dest.joinpath(*folder_path)
+
+        new_folder = folder_path not in planned_folders
+        planned_folders.add(folder_path)
+        # Each file's backup name is worked out once, for the download and for the update cleanup
+        file_names = [get_backup_file_name(file) for file in files]
+        if expected_names is not None:
+            add_expected_names(folder_location, folder_path, file_names, folder_names)
+        if new_folder and archive:
+            archive.add_folder(get_archive_name(folder_location))
+        elif new_folder and not folder_location.exists():
+            try:
+                folder_location.mkdir(parents=True)
+            except:
+                logger.critical(f'Could not create folder: {folder_location}', exc_info=True)
+                stop_backup()
+            logger.info(f'{folder_location} : Folder Created', extra=log_fields(folder_location, 'folder_created'))
+
+        for file, file_name in zip(files, file_names):
+            yield (file, folder_location, prev_folder_location, file_name)
+
+        if new_folder:
+            progress.folder_cnt += 1
+
+def get_folder_pipelined(user_info, source_folder, parent_dest, prev_parent_dest=None):
+    # Lists Google Drive on its own thread and adds each page to the map as it arrives, folders are
+    # downloaded as soon as their path is known while the rest of the listing is still coming in
+    global drive_file_system
+    drive_file_system = DriveFileSystemMap(source_folder)
+    drive_file_system.start_streaming(rename=change_name)
+    listing_queue = queue.Queue()
+    drive_listing = {}
+    scoped = is_source_scoped()
+    scope_ids = {source_folder['id']}
+    deferred_objects = []
+    # Shortcuts are saved as their target, which may be listed later or fetched once the listing ends,
+    # so files with a shortcut's target id are held back until then
+    shortcut_ids = set()
+    held_items = []
+
+    def list_drive():
+        try:
+            with stats.phase('listing'):
+                listing = get_drive_listing(user_info, source_folder, on_objects=lambda objects: listing_queue.put((objects, None)))
+            listing_queue.put((None, listing))
+        except BaseException as e:
+            listing_queue.put((None, e))
+
+    def stream_work_items():
+        pages_streamed = False
+        while True:
+            objects, result = listing_queue.get()
+            if objects is None:
+                break
+            pages_streamed = True
+            yield from add_streamed_objects(objects)
+        if isinstance(result, BaseException):
+            raise result
+        if not pages_streamed:
+            # Listings updated from Drive changes arrive all at once
+            yield from add_streamed_objects(result['files'].values())
+        shortcut_targets = collections.ChainMap(result.get('shortcut_targets', {}), result['files'])
+        yield from add_deferred_objects(shortcut_targets)
+        yield from add_held_items(shortcut_targets)
+        drive_listing.update(result)
+
+    def add_streamed_objects(objects):
+        objects = sorted((dict(object) for object in objects), key=lambda object: object['mimeType'] != 'application/vnd.google-apps.folder')
+        if scoped:
+            objects = scope_streamed_objects(objects)
+        for object in objects:
+            add_streamed_object(object)
+        yield from pop_work_items()
+
+    def add_streamed_object(object, shortcut_targets=None):
+        if object['mimeType'] == 'application/vnd.google-apps.shortcut' and not get_listing_folder_id(object):
+            shortcut_ids.add(object['shortcutDetails']['targetId'])
+        add_drive_object(drive_file_system, object, shortcut_targets)
+
+    def scope_streamed_objects(objects):
+        # Like build_dfsmap, parents outside the source are left out. The scoped listing is breadth
+        # first, so shortcuts to folders wait until the listing ends for the folder itself to be added,
+        # as do parents that aren't known yet
+        for object in objects:
+            folder_id = get_listing_folder_id(object)
+            if folder_id:
+                scope_ids.add(folder_id)
+        scoped_objects = []
+        for object in objects:
+            parents = object.get('parents', [])
+            if object['mimeType'] == 'application/vnd.google-apps.shortcut' and get_listing_folder_id(object):
+                deferred_objects.append(object)
+                continue
+            object['parents'] = [parent_id for parent_id in parents if parent_id in scope_ids]
+            if len(object['parents']) < len(parents):
+                deferred_objects.append(dict(object, parents=[parent_id for parent_id in parents if parent_id not in scope_ids]))
+            scoped_objects.append(object)
+        return scoped_objects
+
+    def add_deferred_objects(shortcut_targets):
+        for object in sorted(deferred_objects, key=lambda object: object['mimeType'] != 'application/vnd.google-apps.folder'):
+            object['parents'] = [parent_id for parent_id in object.get('parents', []) if parent_id in scope_ids]
+            add_streamed_object(object, shortcut_targets)
+        deferred_objects.clear()
+        yield from pop_work_items()
+
+    def add_held_items(shortcut_targets):
+        # The map's records are updated as well as the held files, renamed files are copies of them
+        for item in held_items:
+            for drive_file in itertools.chain(item.files, item.folder.files):
+                target = shortcut_targets.get(drive_file.id)
+                if target is not None:
+                    for field in SHORTCUT_TARGET_FIELDS:
+                        drive_file[field] = target.get(field)
+        yield from count_work_items(held_items)
+
+    def pop_work_items():
+        work_items = []
+        for item in drive_file_system.pop_stream_items():
+            if any(drive_file.id in shortcut_ids for drive_file in item.files):
+                held_items.append(item._replace(files=[drive_file for drive_file in item.files if drive_file.id in shortcut_ids], folders=()))
+                item = item._replace(files=[drive_file for drive_file in item.files if drive_file.id not in shortcut_ids])
+            work_items.append(item)
+        yield from count_work_items(work_items)
+
+    def count_work_items(work_items):
+        progress.total_bytes += sum(int(drive_file.get('size', 0)) for item in work_items for drive_file in item.files)
+        progress.total_files += sum(len(item.files) for item in work_items)
+        yield from work_items
+
+    listing_thread = threading.Thread(target=list_drive, name='list', daemon=True)
+    listing_thread.start()
+    get_folder(parent_dest, prev_parent_dest, stream_work_items())
+    listing_thread.join()
+    drive_file_system.stop_streaming()
+    progress.total_bytes = drive_file_system.get_total_bytes()
+    progress.total_files = drive_file_system.get_total_files()
+    progress.total_folders = drive_file_system.get_total_folders()
+    return drive_listing
+
+def download_files_concurrently(file_jobs):
+    global downloading
+    # Exports are much slower than binary downloads, so they get their own workers and
+    # backlog and a slow export never holds up the planner feeding binary downloads
+    download_executor = ThreadPoolExecutor(max_workers=config.workers, thread_name_prefix='download')
+    export_executor = ThreadPoolExecutor(max_workers=config.export_workers, thread_name_prefix='export')
+    max_download_pending = config.workers * 2
+    download_pending = {}
+    export_pending = {}
+    export_backlog = collections.deque()
+    downloading = True
+
+    def submit_exports():
+        while export_backlog and len(export_pending) < config.export_workers:
+            file_job = export_backlog.popleft()
+            export_pending[export_executor.submit(get_file, *file_job)] = file_job[0]
+
+    def wait_for_results():
+        done, _ = wait(download_pending.keys() | export_pending.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+            drive_file = download_pending.pop(future, None) or export_pending.pop(future)
+            handle_file_result(future.result(), drive_file)
+        submit_exports()
 
-        file_location = get_file(file, folder_location, prev_folder_location)
-        if file_location:
-            logger.info(f'{file_location} : created')
+    try:
+        for file_job in file_jobs:
+            if is_google_document(file_job[0]):
+                export_backlog.append(file_job)
+                submit_exports()
+                continue
+            download_pending[download_executor.submit(get_file, *file_job)] = file_job[0]
+            if len(download_pending) >= max_download_pending:
+                wait_for_results()
+        while download_pending or export_pending:
+            wait_for_results()
+    except BaseException:
+        backup_stopping.set()
+        raise
+    finally:
+        download_executor.shutdown(wait=True, cancel_futures=True)
+        export_executor.shutdown(wait=True, cancel_futures=True)
+        downloading = False
+
+def handle_file_result(file_location, drive_file):
+    global download_errors, export_errors
+    logger = logging.getLogger(__name__)
+    if file_location:
+        logger.info(f'{file_location} : created', extra=log_fields(file_location, 'created'))
+        if not is_google_document(drive_file):
             download_errors = 0
+    elif file_location == None:
+        # Export failures are usually rate limits on conversions, they shouldn't stop the backup
+        if is_google_document(drive_file):
+            export_errors += 1
         else:
-            if file_location == None:
-                download_errors += 1
-                if download_errors >= 5:
-                    logger.critical('Multiple consecutive failed file downloads. Stopping backup, check log for more details.')
-                    stop_backup()
-        progress.file_cnt += 1
+            download_errors += 1
+            if download_errors >= 5:
+                logger.critical('Multiple consecutive failed file downloads. Stopping backup, check log for more details.')
+                stop_backup()
+    progress.add_file(int(drive_file.get('size', 0)))
+
+def is_google_document(drive_file):
+    return drive_file['mimeType'].startswith('application/vnd.google-apps.')
+
+def get_file(drive_file, parent_folder, old_parent_folder=None, file_name=None):
+    if backup_stopping.is_set():
+        raise BackupStopped()
+    logger = logging.getLogger(__name__)
+    action, file_destination, old_file_destination, mimeType_convert = plan_file(drive_file, parent_folder, old_parent_folder, file_name)
+    if action == 'unsupported':
+        logger.info(f"{parent_folder / drive_file['name']} : File is not a downloadable Google Document", extra=log_fields(parent_folder / drive_file['name'], 'not_downloadable'))
+        return ''
+    if action == 'done':
+        return ''
 
-    file_names = None
+    if action in ('skip', 'copy', 'move'):
+        try:
+            if action == 'copy':
+                snapshot_file(old_file_destination, file_destination, get_snapshot_mode())
+            elif action == 'move':
+                shutil.move(old_file_destination, file_destination)
+                if manifest:
+                    manifest.remove(old_file_destination)
+        except FileNotFoundError:
+            # The copy this was planned from is gone, the file is fetched instead
+            action = get_fetch_action(drive_file, mimeType_convert)
+        else:
+            if not config.log_changes:
+                logger.info(f'{file_destination} : Already downloaded current version', extra=log_fields(file_destination, 'current'))
+            if action == 'skip':
+                # The manifest already has a current record for the file
+                if journal:
+                    journal.record_file(drive_file['id'], get_journal_path(file_destination))
+            else:
+                record_file(drive_file, file_destination, mimeType_convert)
+            return ''
 
-    progress.folder_cnt += 1
+    if not archive and not parent_folder.exists():
+        logger.critical(f'Backup destination folder does not exist: {parent_folder}  Restart backup')
+        stop_backup()
 
-    folder_names = set()
-    for folder in drive_folder_object.folders.values():
-        if folder['name'] in folder_names:
-           folder['name'] = change_name(folder['name'])
-           drive_file_system.set_folder_name(folder['id'], folder['name'])
-        folder_names.add(folder['name'])
+    if action == 'empty':
+        if archive:
+            add_to_archive(file_destination, archive.new_buffer(), drive_file)
+        else:
+            # The destination can be hardlinked to an older backup or the content store, truncating it would empty those too
+            file_destination.unlink(missing_ok=True)
+            io.FileIO(file_destination, mode='wb').close()
+        logger.info(f'{file_destination} : File has no data', extra=log_fields(file_destination, 'empty'))
+        record_file(drive_file, file_destination, mimeType_convert)
+        return ''
 
-        child_folder_object = drive_file_system.get_folder(folder['id'])
-        get_folder(folder_location, prev_parent_dest=prev_folder_location, drive_folder_object=child_folder_object)
+    fetch = fetch_archived_file if archive else fetch_file
+    # Zip archives can't link one entry to another, every location is fetched
+    if archive and not archive.supports_links:
+        return file_destination if fetch(drive_file, file_destination, mimeType_convert) else None
+
+    # A file in several folders, or the target of shortcuts, is fetched once and linked everywhere else
+    download_key = (drive_file['id'], mimeType_convert)
+    fetched_destination = download_tracker.claim(download_key)
+    if fetched_destination:
+        if archive:
+            archive.add_link(get_archive_name(file_destination), get_archive_name(fetched_destination))
+        else:
+            snapshot_file(fetched_destination, file_destination, get_snapshot_mode())
+        logger.info(f'{file_destination} : Linked to {fetched_destination}', extra=log_fields(file_destination, 'linked'))
+        record_file(drive_file, file_destination, mimeType_convert)
+        return file_destination
 
-def get_file(drive_file, parent_folder, old_parent_folder=None):
+    complete = False
+    try:
+        complete = fetch(drive_file, file_destination, mimeType_convert)
+    finally:
+        download_tracker.finish(download_key, file_destination if complete else None)
+    return file_destination if complete else None
+
+def get_media_request(drive_file, mimeType_convert):
+    if mimeType_convert:
+        return get_service().files().export_media(fileId=drive_file['id'], mimeType=mimeType_convert)
+    return get_service().files().get_media(fileId=drive_file['id'], supportsAllDrives=True)
+
+def fetch_archived_file(drive_file, file_destination, mimeType_convert):
+    # Downloads into a buffer that is handed to the archive, so the file is never written to the backup folder
     logger = logging.getLogger(__name__)
-    if re.match('application/vnd\.google-apps\..+', drive_file['mimeType']):
-        mimeType_convert = get_mimeType(drive_file['mimeType'])
-        if not mimeType_convert:
-            logger.info(f"{parent_folder / drive_file['name']} : File is not a downloadable Google Document")
-            return ''
-        request = service.files().export_media(fileId=drive_file['id'],mimeType=mimeType_convert)
-        drive_file_name = f"{drive_file['name']}.{FILE_EXTENSIONS.get(mimeType_convert)}"
+    buffer = archive.new_buffer()
+    cache_key = ExportCache.get_key(drive_file, mimeType_convert) if export_cache and mimeType_convert else None
+    if cache_key and export_cache.get(cache_key, buffer):
+        logger.info(f'{file_destination} : Using cached export')
+        complete = True
     else:
-        request = service.files().get_media(fileId=drive_file['id'])
-        drive_file_name = drive_file['name']
+        request = get_media_request(drive_file, mimeType_convert)
+        num_retries = config.export_retries if mimeType_convert else config.download_retries
+        complete = download_media(drive_file, request, file_destination, num_retries=num_retries, fh=buffer)
+        if complete and cache_key:
+            buffer.seek(0)
+            export_cache.put(cache_key, buffer)
 
-    if not parent_folder.exists():
-        logger.critical(f'Backup destination folder does not exist: {parent_folder}  Restart backup')
+    if not complete:
+        buffer.close()
+        logger.error(f'{file_destination} : Was not downloaded due to an error. Check the log for more details.', extra=log_fields(file_destination, 'failed'))
+        return False
+    add_to_archive(file_destination, buffer, drive_file)
+    record_file(drive_file, file_destination, mimeType_convert)
+    return True
+
+def add_to_archive(file_destination, buffer, drive_file):
+    try:
+        archive.add_file(get_archive_name(file_destination), buffer, get_modified_time(drive_file))
+    except Exception:
+        logger = logging.getLogger(__name__)
+        logger.critical(f"Could not write to the archive '{archive.path}'.", exc_info=True)
         stop_backup()
 
-    file_destination = parent_folder / drive_file_name
-    old_file_destination = None
-    if old_parent_folder and old_parent_folder.exists():
-        old_file_destination = old_parent_folder / drive_file_name
-
-    if not should_download(drive_file, file_destination) or (old_file_destination and not should_download(drive_file, old_file_destination)):
-        if not config.log_changes:
-            logger.info(f'{file_destination} : Already downloaded current version')
-        if old_file_destination and old_file_destination.exists(): #need the extra check to ensure no errors in the event of duplicate files with same name
-            if config.backup_type == 'complete':
-                shutil.copy2(old_file_destination, file_destination)
-            elif config.backup_type == 'increment':
-                shutil.move(old_file_destination, file_destination)
-        return ''
+def get_archive_name(path):
+    return path.relative_to(config.destination).as_posix()
+
+def get_modified_time(drive_file):
+    return calendar.timegm(time.strptime(drive_file['modifiedTime'], '%Y-%m-%dT%H:%M:%S.%fZ'))
+
+def fetch_file(drive_file, file_destination, mimeType_convert):
+    logger = logging.getLogger(__name__)
+    # Downloads land in a .part file that is renamed when complete, this also leaves
+    # an older backup hardlinked to the destination untouched
+    part_destination = file_destination.with_name(file_destination.name + PART_SUFFIX)
+    cache_key = ExportCache.get_key(drive_file, mimeType_convert) if export_cache and mimeType_convert else None
+    if cache_key and export_cache.get(cache_key, part_destination):
+        logger.info(f'{file_destination} : Using cached export')
+        complete = True
+    else:
+        request = get_media_request(drive_file, mimeType_convert)
+        resume_offset = get_resume_offset(drive_file, part_destination, mimeType_convert)
+        num_retries = config.export_retries if mimeType_convert else config.download_retries
+        complete = download_media(drive_file, request, part_destination, resume_offset, num_retries)
+        if complete and resume_offset and get_file_md5(part_destination) != drive_file['md5Checksum']:
+            logger.warning(f'{file_destination} : Resumed download does not match, downloading again.')
+            complete = download_media(drive_file, request, part_destination, num_retries=num_retries)
+        if complete and cache_key:
+            export_cache.put(cache_key, part_destination)
 
+    if not complete:
+        logger.error(f'{file_destination} : Was not downloaded due to an error. Check the log for more details.', extra=log_fields(file_destination, 'failed'))
+        if mimeType_convert:
+            part_destination.unlink(missing_ok=True)
+    else:
+        new_content = True
+        if content_store and part_destination.stat().st_size:
+            digest = drive_file['md5Checksum'] if drive_file.get('md5Checksum') and not mimeType_convert else get_file_md5(part_destination)
+            new_content = content_store.add(part_destination, digest, file_destination)
+        else:
+            part_destination.replace(file_destination)
+        # Stored content is shared with other files, its modified time is only set when it is first stored
+        if new_content:
+            driveFileTimeSecs = get_modified_time(drive_file)
+            os.utime(file_destination, (driveFileTimeSecs,driveFileTimeSecs))
+        record_file(drive_file, file_destination, mimeType_convert)
+
+    return complete
+
+def plan_file(drive_file, parent_folder, old_parent_folder=None, file_name=None):
+    # Decides what the backup does with a file without changing anything, used by get_file and by --dry-run.
+    # file_name is the file's get_backup_file_name() when it is already known
+    drive_file_name, mimeType_convert = file_name or get_backup_file_name(drive_file)
+    if not drive_file_name:
+        return ('unsupported', None, None, None)
+
+    # With a manifest the decision is made from its records, the disk is only touched when a copy or move runs
+    file_destination = parent_folder / drive_file_name
+    old_file_destination = old_parent_folder / drive_file_name if old_parent_folder else None
 
-    fh = io.FileIO(file_destination, mode='wb')
+    if journal and journal.is_complete(drive_file['id'], get_journal_path(file_destination)):
+        action = 'done'
+    elif planned_actions is not None and (drive_file['id'], parent_folder) in planned_actions:
+        action = planned_actions[(drive_file['id'], parent_folder)]
+    else:
+        action = None
+        old_is_current = old_file_destination is not None and not should_download(drive_file, old_file_destination, mimeType_convert)
+        if old_is_current and config.backup_type == 'complete':
+            action = 'copy'
+        elif old_is_current and config.backup_type == 'increment':
+            action = 'move'
+        elif not should_download(drive_file, file_destination, mimeType_convert):
+            action = 'skip'
+        if action is None:
+            action = get_fetch_action(drive_file, mimeType_convert)
+    return (action, file_destination, old_file_destination, mimeType_convert)
+
+def get_fetch_action(drive_file, mimeType_convert):
     if drive_file.get('size') == '0':
-        fh.close()
-        logger.info(f'{file_destination} : File has no data')
-        return ''
+        return 'empty'
+    return 'export' if mimeType_convert else 'download'
+
+def get_snapshot_mode():
+    # Files in the content store are always linked, so they keep counting as references to it
+    return 'hardlink' if content_store else config.snapshot_mode
 
-    downloader = MediaIoBaseDownload(fh, request, chunksize=1024*1024)
+def get_backup_file_name(drive_file):
+    # The name a file is saved with and the mimeType Google Documents are exported as, None when it can't be downloaded
+    if is_google_document(drive_file):
+        mimeType_convert = get_mimeType(drive_file['mimeType'])
+        if not mimeType_convert:
+            return (None, None)
+        return (f"{drive_file['name']}.{FILE_EXTENSIONS.get(mimeType_convert)}", mimeType_convert)
+    return (drive_file['name'], None)
+
+def get_resume_offset(drive_file, part_destination, export_mime_type):
+    # Exports can't be fetched by range, and without a checksum a resumed file can't be verified
+    if export_mime_type or not drive_file.get('md5Checksum'):
+        return 0
+    try:
+        part_size = part_destination.stat().st_size
+    except FileNotFoundError:
+        return 0
+    if part_size >= int(drive_file.get('size', 0)):
+        return 0
+    return part_size
+
+def download_media(drive_file, request, part_destination, resume_offset=0, num_retries=None, fh=None):
+    # Downloads into part_destination, or into fh when it is given
+    logger = logging.getLogger(__name__)
+    if resume_offset:
+        logger.info(f'{part_destination} : Resuming download at {resume_offset} bytes')
+    close_file = fh is None
+    if close_file:
+        fh = io.FileIO(part_destination, mode='ab' if resume_offset else 'wb')
+    file_size = int(drive_file['size']) if drive_file.get('size') else None
+    downloader = ChunkedDownload(fh, request, file_size=file_size, offset=resume_offset)
+    method = 'files.export_media' if is_google_document(drive_file) else 'files.get_media'
     complete = False
 
 
     while complete is False:
+        if backup_stopping.is_set():
+            # The .part file is kept, the download resumes from it with --resume
+            if close_file:
+                fh.close()
+            raise BackupStopped()
         try:
-            status, complete = downloader.next_chunk(num_retries=5)
+            progress_before = downloader.progress
+            status, complete = scheduler.call(downloader.next_chunk, num_retries=num_retries, method=method)
+            stats.record_bytes(method, downloader.progress - progress_before)
+            progress.add_bytes(downloader.progress - progress_before)
             if status.total_size == None:
                 complete = True
-                logger.warning(f'{file_destination} : File may not have been fully downloaded.')
+                logger.warning(f'{part_destination} : File may not have been fully downloaded.')
                 break
         except errors.HttpError as e:
             if is_abusive_file_error(e.content):
-                progress.state = progress.state.PAUSE
-                prompt = (
-                    '[bold cyan]Problem downloading:[/]\n' +
-                    f"'[yellow]{drive_file_name}[/]' is marked as potential malware or spam.\n"
-                    "[bold cyan]Are you sure you want to download it?[/]"
-                )
-                download_abusive_file = Confirm.ask(prompt, console=console)
-                console.print()
-                progress.state = progress.state.DOWNLOAD
+                download_abusive_file = confirm_abusive_file(drive_file['name'])
                 if download_abusive_file:
-                    request = service.files().get_media(fileId=drive_file['id'], acknowledgeAbuse=True)
-                    downloader = MediaIoBaseDownload(fh, request, chunksize=1024*1024)
+                    request = get_service().files().get_media(fileId=drive_file['id'], acknowledgeAbuse=True, supportsAllDrives=True)
+                    downloader = ChunkedDownload(fh, request, file_size=file_size, offset=downloader.progress)
                 else:
                     break
             else:
                 logger.exception('Could not complete request due to error.')
                 break
+        except (OSError, httplib2.HttpLib2Error):
+            logger.exception('Could not complete request due to error.')
+            break
 
 
-    fh.close()
-
-    if not complete:
-        logger.error(f'{file_destination} : Was not downloaded due to an error. Check the log for more details.')
-        file_destination.unlink()
-    else:
-        driveFileTime = time.strptime(drive_file['modifiedTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-        driveFileTimeSecs = calendar.timegm(driveFileTime)
-        os.utime(file_destination, (driveFileTimeSecs,driveFileTimeSecs))
-
-    return file_destination if complete else None
+    if close_file:
+        fh.close()
+    return complete
+
+def record_file(drive_file, file_destination, export_mime_type):
+    if manifest:
+        manifest.add(file_destination, drive_file, export_mime_type)
+    if journal:
+        journal.record_file(drive_file['id'], get_journal_path(file_destination))
+
+def get_journal_path(file_destination):
+    return file_destination.relative_to(config.destination).as_posix()
+
+def confirm_abusive_file(drive_file_name):
+    with prompt_lock:
+        progress.state = progress.state.PAUSE
+        prompt = (
+            '[bold cyan]Problem downloading:[/]\n' +
+            f"'[yellow]{drive_file_name}[/]' is marked as potential malware or spam.\n"
+            "[bold cyan]Are you sure you want to download it?[/]"
+        )
+        download_abusive_file = Confirm.ask(prompt, console=console)
+        console.print()
+        progress.state = progress.state.DOWNLOAD
+    return download_abusive_file
 
 def validate(name):
     validate_filename(name, platform="auto")
@@ -330,9 +1093,15 @@ def get_mimeType(google_mimeType):
         new_mimeType = 'application/pdf'
     return new_mimeType
 
-def should_download(drive_file, path):
+def should_download(drive_file, path, export_mime_type=None):
+    if manifest:
+        record = manifest.get_record(path)
+        if record is not None:
+            return not is_record_current(record, drive_file, export_mime_type)
     if not path.exists():
         return True
+    if config.change_detection == 'hash' and drive_file.get('md5Checksum'):
+        return get_file_md5(path) != drive_file['md5Checksum']
     drive_file_time = calendar.timegm(time.strptime(drive_file['modifiedTime'], '%Y-%m-%dT%H:%M:%S.%fZ'))
     backup_file_time = path.stat().st_mtime
     if drive_file_time > backup_file_time:
@@ -340,6 +1109,25 @@ def should_download(drive_file, path):
     else:
         return False
 
+def is_record_current(record, drive_file, export_mime_type):
+    if record.file_id != drive_file['id'] or record.export_mime_type != export_mime_type:
+        return False
+    if config.change_detection != 'modified':
+        if drive_file.get('md5Checksum') and record.md5_checksum:
+            return drive_file['md5Checksum'] == record.md5_checksum
+        if drive_file.get('headRevisionId') and record.head_revision_id:
+            return drive_file['headRevisionId'] == record.head_revision_id
+        if drive_file.get('version') and record.version:
+            return drive_file['version'] == record.version
+    return record.modified_time >= drive_file['modifiedTime']
+
+def get_file_md5(path):
+    file_hash = hashlib.md5()
+    with path.open('rb') as f:
+        while chunk := f.read(1024*1024):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
 def is_abusive_file_error(content):
     try:
         data = json.loads(content.decode('utf-8'))
@@ -349,96 +1137,174 @@ def is_abusive_file_error(content):
 
 
 def clean_backup(save_destination, prev_save_destination=None):
+    cleanup = BackupCleanup(config.workers, on_remove=removed_backup_item)
     if config.backup_type == 'increment' and prev_save_destination:
-        clean_incremental_backup(save_destination, prev_save_destination)
+        cleanup.clean_incremental(save_destination, prev_save_destination)
     elif config.backup_type == 'update':
-        clean_updated_backup(save_destination)
-
-
-def clean_incremental_backup(save_destination, prev_save_destination):
-    current_directory_items = prev_save_destination.iterdir()
-
-    keep_directory = False
-    for item in current_directory_items:
-        if item.is_file():
-            keep_directory = True
-        else:
-            new_destination = save_destination / item.name
-            keep_directory = clean_incremental_backup(new_destination, item) or keep_directory
-
-    if not keep_directory:
-        if save_destination.exists():
-            prev_save_destination.rmdir()
-        else:
-            keep_directory = True
-
-    return keep_directory
-
-def clean_updated_backup(save_destination, drive_folder_object=None):
+        if expected_names is None:
+            # Nothing was downloaded this run, work out the names from the map
+            plan_folder_names(save_destination)
+        cleanup.clean_updated(expected_names)
+    return cleanup
+
+def plan_folder_names(save_destination):
+    global expected_names
+    expected_names = {}
+    for folder_path, _, files, folder_names in walk_backup():
+        file_names = [get_backup_file_name(file) for file in files]
+        add_expected_names(save_destination.joinpath(*folder_path), folder_path, file_names, folder_names)
+
+def add_expected_names(folder_location, folder_path, file_names, folder_names):
+    names = expected_names.setdefault(folder_location, set())
+    names.update(folder_names)
+    # Streamed work items don't list their subfolders, each folder adds itself to its parent instead
+    if len(folder_path) > 1:
+        expected_names.setdefault(folder_location.parent, set()).add(folder_path[-1])
+    names.update(drive_file_name for drive_file_name, _ in file_names if drive_file_name)
+
+def removed_backup_item(path, is_folder):
     logger = logging.getLogger(__name__)
-    if not drive_folder_object:
-        drive_folder_object = drive_file_system.get_root_folder()
-
-    folder_location = save_destination / drive_folder_object.name
-
-    current_directory = set((item.name for item in folder_location.iterdir()))
-
-    for file in drive_folder_object.files.values():
-        if re.match('application/vnd\.google-apps\..+', file['mimeType']):
-            mimeType_convert = get_mimeType(file['mimeType'])
-            if not mimeType_convert:
-                continue
-            drive_file_name = f"{file['name']}.{FILE_EXTENSIONS.get(mimeType_convert)}"
-        else:
-            drive_file_name = file['name']
-
-        if drive_file_name in current_directory:
-            current_directory.remove(drive_file_name)
+    if is_folder:
+        logger.info(f'{path} : Removed Folder', extra=log_fields(path, 'removed_folder'))
+    else:
+        logger.info(f'{path} : Removed File', extra=log_fields(path, 'removed_file'))
+    if manifest:
+        manifest.remove(Path(path))
 
-    for folder in drive_folder_object.folders.values():
-        local_folder = folder['name']
-        if local_folder in current_directory:
-            current_directory.remove(local_folder)
 
-    for item in current_directory:
-        item_destination = folder_location / item
-        if item_destination.is_file():
-            item_destination.unlink()
-            logger.info(f'{item_destination} : Removed File')
-        else:
-            shutil.rmtree(item_destination)
-            logger.info(f'{item_destination} : Removed Folder')
+def get_resumed_destination():
+    save_destination = config.destination / journal.backup
+    save_destination.mkdir(parents=True, exist_ok=True)
+    recent_backup_destination = None
+    if journal.prev_backup and (config.destination / journal.prev_backup).is_dir():
+        recent_backup_destination = config.destination / journal.prev_backup
+    return (save_destination, recent_backup_destination)
 
-    current_directory = None
+def open_journal():
+    global journal
+    journal = BackupJournal(config.get_journal_path())
+    config.destination.mkdir(parents=True, exist_ok=True)
+    return config.resume and journal.load()
+
+def open_export_cache():
+    global export_cache
+    if not config.export_cache:
+        export_cache = None
+        return
+    export_cache = ExportCache(config.get_export_cache_path(), config.export_cache_size * 1024 * 1024)
+
+def open_content_store():
+    global content_store
+    content_store = None
+    # Archived backups aren't stored as files, so there is nothing to link to the store
+    if config.store != 'content' or config.archive:
+        return
+    store = ContentStore(config.get_store_path())
+    if not store.supports_hardlinks():
+        logger = logging.getLogger(__name__)
+        logger.warning(f"Hardlinks are not supported in '{config.destination}', files will not be stored in the content store.")
+        return
+    content_store = store
+
+def open_archive(save_destination):
+    global archive
+    archive = None
+    if not config.archive:
+        return
+    logger = logging.getLogger(__name__)
+    if config.backup_type != 'complete' or config.resume:
+        logger.critical("Backups saved to an archive are always 'complete' backups and can't be resumed.")
+        stop_backup()
+    try:
+        archive = BackupArchive(BackupArchive.get_archive_path(save_destination, config.archive), config.archive, max_pending=config.workers * 2)
+    except (ImportError, OSError) as e:
+        logger.critical(f'Could not create the archive: {e}')
+        stop_backup()
 
-    for folder in drive_folder_object.folders.values():
-        child_folder_object = drive_file_system.get_folder(folder['id'])
-        clean_updated_backup(folder_location, child_folder_object)
+def close_archive():
+    try:
+        archive.close()
+    except Exception:
+        logger = logging.getLogger(__name__)
+        logger.critical(f"Could not finish the archive '{archive.path}'.", exc_info=True)
+        stop_backup()
 
+def open_manifest(read_only=False):
+    global manifest
+    # The manifest describes the files in backup folders, an archive is always written from the start
+    if not config.manifest or config.archive:
+        return
+    manifest_path = config.get_manifest_path()
+    if not read_only:
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest = BackupManifest(manifest_path, config.destination, read_only=read_only)
 
 def stop_backup():
+    # Download workers still write to the manifest, journal and log, they are stopped before any of it is closed
+    backup_stopping.set()
+    if downloading or threading.current_thread() is not threading.main_thread():
+        raise BackupStopped()
     logger = logging.getLogger(__name__)
     logger.critical('Could not complete backup. Check terminal and/or log file for more info.')
+    if manifest:
+        manifest.flush()
+    if journal:
+        journal.close()
+    if archive:
+        archive.abort()
+    store_stats(completed=False)
     progress.state = progress.State.STOP
     if config.notifications:
         show_notification(title=APPLICATION_NAME, body="There was a problem completing the backup. Check the terminal/log for more info.")
+    stop_logging()
     sys.exit(1)
 
 def get_user():
     try:
-        return service.about().get(fields="user").execute()
+        return scheduler.execute(get_service().about().get(fields="user"))
     except:
         logger = logging.getLogger(__name__)
         logger.critical('Error Getting User Info.', exc_info=True)
         stop_backup()
 
-def setup_logging(log_destination):
+class JsonLogFormatter(logging.Formatter):
+    # One JSON object per line, per file records also have the path and what happened to it
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'name': record.name,
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        for field in ('event', 'path'):
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler.prepare adds the traceback to the message and clears exc_info, here the message
+    # is only filled in and the listener's formatter gets the traceback, for the JSON exception field
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def log_fields(path, event):
+    return {'path': str(path), 'event': event}
+
+def setup_logging(log_destination, mode='w'):
+    global log_listener
     root_logger = logging.getLogger()
     root_logger.setLevel(config.log_level)
 
     log_file = config.log_path or (log_destination / DEFAULT_LOG)
     try:
-        file_handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+        file_handler = logging.FileHandler(log_file, mode=mode, encoding='utf-8')
     except FileNotFoundError:
         logger = logging.getLogger(__name__)
         logger.critical(f"Log file '{log_file}' could not be created.")
@@ -453,11 +1319,45 @@ def setup_logging(log_destination):
         file_handler.addFilter(filter)
         name_spacing = ''
 
-    file_formatter = logging.Formatter('%(asctime)s - %(name)' + name_spacing + 's - %(levelname)8s - %(message)s')
+    if config.log_format == 'json':
+        file_formatter = JsonLogFormatter()
+    else:
+        file_formatter = logging.Formatter('%(asctime)s - %(name)' + name_spacing + 's - %(levelname)8s - %(message)s')
 
     file_handler.setFormatter(file_formatter)
 
-    root_logger.addHandler(file_handler)
+    if config.log_async:
+        # Records are handed to a queue and written by a background thread, so a slow destination doesn't hold up downloads
+        log_queue = queue.SimpleQueue()
+        queue_handler = LogQueueHandler(log_queue)
+        queue_handler.setLevel(config.log_level)
+        root_logger.addHandler(queue_handler)
+        log_listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+        log_listener.start()
+    else:
+        root_logger.addHandler(file_handler)
+
+def stop_logging():
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+        # Nothing reads the queue anymore
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers[:]:
+            if isinstance(handler, LogQueueHandler):
+                root_logger.removeHandler(handler)
+
+def store_stats(completed):
+    if config.dry_run:
+        return
+    try:
+        stats.store(config.get_stats_path(), backup=journal.backup if journal else None, backup_type=config.backup_type, completed=completed, files=progress.file_cnt,
+                    quota_errors=scheduler.quota_errors, quota_stall_time=round(scheduler.quota_stall_time, 3),
+                    export_cache_hits=export_cache.hits if export_cache else None, export_cache_misses=export_cache.misses if export_cache else None)
+    except OSError:
+        logger = logging.getLogger(__name__)
+        logger.warning('Could not store the backup stats.', exc_info=True)
 
 def progress_update(msg):
     logger = logging.getLogger(__name__)
@@ -466,19 +1366,219 @@ def progress_update(msg):
     logger.info(plain_text)
     console.print(text)
 
-def run_drive_backup():
-    progress.state = progress.State.INITIATE
-    save_destination, recent_backup_destination = get_save_destination()
+def report_shared_drives(drive_listing):
+    if drive_listing.get('shared_drives'):
+        progress_update(f"[bold cyan]Shared Drives:[/] {', '.join(listing['name'] for listing in drive_listing['shared_drives'])}")
 
-    setup_logging(save_destination)
+def get_available_space(path):
+    while not path.exists():
+        path = path.parent
+    return shutil.disk_usage(path).free
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1024 or unit == 'TB':
+            break
+        size /= 1024
+    return f'{size:.1f} {unit}' if unit != 'B' else f'{size} {unit}'
+
+def build_backup_plan(plan, save_destination, recent_backup_destination):
+    # An update backup that hasn't started yet still has its files under the previous backup's name
+    check_destination = save_destination
+    if config.backup_type == 'update':
+        if not save_destination.exists() and recent_backup_destination:
+            check_destination = recent_backup_destination
+        recent_backup_destination = None
+
+    for folder_path, _, files, folder_names in walk_backup():
+        plan.add_folder(folder_path, folder_names)
+        folder_location = check_destination.joinpath(*folder_path)
+        prev_folder_location = recent_backup_destination.joinpath(*folder_path) if recent_backup_destination else None
+        for file in files:
+            action, *_ = plan_file(file, folder_location, prev_folder_location)
+            plan.add_file(file, action)
+
+def report_backup_plan(plan, save_destination):
+    progress_update('[bold cyan]Backup Plan')
+    for action in BackupPlan.ACTIONS:
+        files = plan.get_files(action)
+        if files:
+            progress_update(f'  [bold cyan]{action.capitalize()}:[/] {files} files, {format_size(plan.get_bytes(action))}')
+    if plan.get_files('linked'):
+        progress_update(f"  [bold cyan]Linked:[/] {plan.get_files('linked')} of these files are at more than one path and are only fetched once")
+
+    # Google Documents have no size until they are exported, so exports aren't counted. A file in
+    # several folders is only downloaded once, its other copies only take space when they are copied
+    required_bytes = plan.get_bytes('download', 'empty')
+    if config.snapshot_mode == 'copy' and config.store != 'content':
+        required_bytes += plan.get_bytes('copy', 'linked')
+    available_bytes = get_available_space(save_destination)
+    progress_update(f'[bold cyan]Space Required:[/] {format_size(required_bytes)} ({plan.get_files("export")} Google Documents not included)')
+    progress_update(f'[bold cyan]Space Available:[/] {format_size(available_bytes)}')
+    if required_bytes > available_bytes:
+        progress_update('[bold red]There is not enough free space at the destination for this backup.')
+
+def load_backup_plan(save_destination, recent_backup_destination):
+    logger = logging.getLogger(__name__)
+    plan = BackupPlan.load(config.plan_file)
+    prev_backup = recent_backup_destination.name if recent_backup_destination else None
+    if plan.backup != save_destination.name or plan.prev_backup != prev_backup or plan.backup_type != config.backup_type:
+        logger.warning(f"Backup plan '{config.plan_file}' was made for a different backup, it will not be used.")
+        return None
+    return plan.get_actions(save_destination)
+
+def plan_drive_backup():
+    run_until_stopped(plan_backup)
+
+def plan_backup():
+    # Runs everything up to the downloads and reports what the backup would do, nothing in the destination is changed
+    global credentials, scheduler, drive_file_system, shared_drive_maps
+    progress.state = progress.State.INITIATE
+    if config.log_path:
+        setup_logging(config.log_path.parent)
+    if config.manifest and config.get_manifest_path().exists():
+        open_manifest(read_only=True)
+    save_destination, recent_backup_destination = get_backup_destinations()
 
     progress_update('[bold cyan]Getting Credentials')
     credentials = get_user_credentials()
     if not credentials:
         stop_backup()
     progress_update('[bold cyan]Verified Credentials')
-    global service
-    service = discovery.build('drive', 'v3', credentials=credentials)
+    scheduler = RequestScheduler(config.max_requests_per_second, config.max_concurrent_requests)
+
+    user_info = get_user()
+    progress_update(f"[bold cyan]Drive Account:[/] {user_info['user']['displayName']} {user_info['user']['emailAddress']}")
+
+    source_folder = get_source_folder()
+    if not source_folder:
+        stop_backup()
+    progress_update(f"[bold cyan]Source Folder:[/] {source_folder['name']}")
+    progress_update(f'[bold cyan]Backup Type:[/] {config.backup_type.capitalize()}')
+    progress_update(f'[bold cyan]Backup files to:[/] {save_destination}')
+
+    progress_update('[bold cyan]Planning Backup')
+    progress.state = progress.State.PREPARE
+    drive_listing = get_drive_listing(user_info, source_folder)
+    drive_file_system = build_dfsmap(source_folder, drive_listing)
+    shared_drive_maps = build_shared_drive_maps(drive_listing)
+    report_shared_drives(drive_listing)
+
+    prev_backup = recent_backup_destination.name if recent_backup_destination and config.backup_type != 'update' else None
+    plan = BackupPlan(save_destination.name, prev_backup, config.backup_type, keep_files=config.plan_file is not None)
+    build_backup_plan(plan, save_destination, recent_backup_destination)
+    progress.state = progress.State.COMPLETE
+
+    console.print()
+    report_backup_plan(plan, save_destination)
+    if config.plan_file:
+        plan.store(config.plan_file)
+        progress_update(f'[bold cyan]Backup plan saved to:[/] {config.plan_file}')
+    if manifest:
+        manifest.close()
+    stop_logging()
+
+def get_existing_store():
+    store_path = config.get_store_path()
+    if not store_path.is_dir():
+        console.print(f"No content store found at '{store_path}'.")
+        return None
+    return ContentStore(store_path)
+
+def view_store_info():
+    console.print("[cyan bold]Content Store Info")
+    store = get_existing_store()
+    if not store:
+        return
+    entries, stored, referenced = store.get_usage()
+    console.print(f'[bold cyan]Stored Files:[/] {entries}')
+    console.print(f'[bold cyan]Space Used:[/] {format_size(stored)}')
+    console.print(f'[bold cyan]Space Used By Backups Without The Store:[/] {format_size(referenced)}')
+    console.print(f'[bold cyan]Space Saved:[/] {format_size(max(referenced - stored, 0))}')
+    if stored:
+        console.print(f'[bold cyan]Dedup Ratio:[/] {referenced / stored:.2f}')
+
+def collect_store_garbage():
+    console.print("[cyan bold]Clean Content Store")
+    store = get_existing_store()
+    if not store:
+        return
+    removed, freed = store.collect_garbage()
+    console.print(f'[bold cyan]Removed:[/] {removed} files no backup uses anymore, freed {format_size(freed)}')
+
+def get_archive_index(archive_path):
+    if not BackupArchive.get_index_path(archive_path).is_file():
+        console.print(f"No archive index found for '{archive_path}'.")
+        return None
+    return BackupArchive.list_files(archive_path)
+
+def list_archive_files(archive_path):
+    files = get_archive_index(archive_path)
+    if files is None:
+        return
+    for name, entry in files.items():
+        if 'link' in entry:
+            console.print(f'{name} [cyan]->[/] {entry["link"]}', highlight=False)
+        else:
+            console.print(f'{name} [cyan]{format_size(entry["size"])}[/]', highlight=False)
+
+def extract_archive_file(archive_path, name, output):
+    files = get_archive_index(archive_path)
+    if files is None:
+        return
+    if name not in files:
+        console.print(f"'{name}' is not in the archive.")
+        return
+    output = Path(output or Path(name).name).resolve()
+    BackupArchive.extract(archive_path, name, output)
+    console.print(f'[bold cyan]Extracted:[/] {name} to {output}')
+
+def run_drive_backup():
+    run_until_stopped(backup_drive)
+
+def run_until_stopped(backup):
+    backup_stopping.clear()
+    try:
+        backup()
+    except BackupStopped:
+        # Raised from a thread or while downloading, every worker has finished by now
+        stop_backup()
+    finally:
+        # Records still queued for --log-async are written even when the backup fails unexpectedly
+        stop_logging()
+
+def backup_drive():
+    global planned_actions, stats, download_tracker
+    stats = BackupStats()
+    download_tracker = DownloadTracker()
+    progress.state = progress.State.INITIATE
+    open_manifest()
+    resumed = open_journal()
+    open_export_cache()
+    open_content_store()
+    if resumed:
+        save_destination, recent_backup_destination = get_resumed_destination()
+    else:
+        save_destination, recent_backup_destination = get_save_destination()
+        journal.start(save_destination.name, recent_backup_destination.name if recent_backup_destination else None)
+    open_archive(save_destination)
+
+    setup_logging(config.destination if archive else save_destination, mode='a' if resumed else 'w')
+    if config.plan_file:
+        planned_actions = load_backup_plan(save_destination, recent_backup_destination)
+    if config.resume and not resumed:
+        logger = logging.getLogger(__name__)
+        logger.info('No interrupted backup to resume, starting a new backup.')
+
+    progress_update('[bold cyan]Getting Credentials')
+    global credentials
+    with stats.phase('credentials'):
+        credentials = get_user_credentials()
+    if not credentials:
+        stop_backup()
+    progress_update('[bold cyan]Verified Credentials')
+    global scheduler
+    scheduler = RequestScheduler(config.max_requests_per_second, config.max_concurrent_requests, stats=stats, shared_slots=shared_request_slots)
 
     user_info = get_user()
     progress_update(f"[bold cyan]Drive Account:[/] {user_info['user']['displayName']} {user_info['user']['emailAddress']}")
@@ -490,27 +1590,86 @@ def run_drive_backup():
 
     progress_update(f'[bold cyan]Backup Type:[/] {config.backup_type.capitalize()}')
 
-    progress_update(f'[bold cyan]Backup files to:[/] {save_destination}')
+    progress_update(f'[bold cyan]Backup files to:[/] {archive.path if archive else save_destination}')
 
     progress_update('[bold cyan]Preparing Backup')
     progress.state = progress.State.PREPARE
-    global drive_file_system
-    drive_file_system = build_dfsmap(source_folder)
-    progress.total_files = drive_file_system.get_total_files()
-    progress.total_folders = drive_file_system.get_total_folders()
-    progress_update('[bold cyan]Starting Backup')
-    progress.state = progress.State.DOWNLOAD
-    get_folder(save_destination, recent_backup_destination)
+    global drive_file_system, shared_drive_maps, expected_names
+    # An update backup removes everything that wasn't named while downloading
+    expected_names = {} if config.backup_type == 'update' else None
+    shared_drive_maps = []
+    if config.pipeline and not (resumed and journal.drive_listing):
+        progress_update('[bold cyan]Starting Backup While Listing Drive')
+        progress.state = progress.State.DOWNLOAD
+        with stats.phase('download'):
+            drive_listing = get_folder_pipelined(user_info, source_folder, save_destination, recent_backup_destination)
+            # Shared drives aren't streamed, they are downloaded once My Drive is done
+            shared_drive_maps = build_shared_drive_maps(drive_listing)
+            journal.record_listing(drive_listing)
+            start_page_token = stage_drive_listing(drive_listing)
+            drive_listing = None
+            if shared_drive_maps:
+                set_progress_totals()
+                get_folder(save_destination, recent_backup_destination, walk_shared_drives())
+    else:
+        if resumed and journal.drive_listing:
+            progress_update('[bold cyan]Resuming Interrupted Backup')
+            drive_listing = journal.drive_listing
+            journal.drive_listing = None
+        else:
+            with stats.phase('listing'):
+                drive_listing = get_drive_listing(user_info, source_folder)
+            journal.record_listing(drive_listing)
+        with stats.phase('map'):
+            drive_file_system = build_dfsmap(source_folder, drive_listing)
+            shared_drive_maps = build_shared_drive_maps(drive_listing)
+        report_shared_drives(drive_listing)
+        start_page_token = stage_drive_listing(drive_listing)
+        drive_listing = None
+        set_progress_totals()
+        progress_update('[bold cyan]Starting Backup')
+        progress.state = progress.State.DOWNLOAD
+        with stats.phase('download'):
+            get_folder(save_destination, recent_backup_destination)
+    if archive:
+        with stats.phase('archive'):
+            close_archive()
     progress.state = progress.State.COMPLETE
 
     if config.backup_type != 'complete':
         console.print()
         progress_update('[bold cyan]Cleaning Up Backup')
-        clean_backup(save_destination, recent_backup_destination)
+        with stats.phase('cleanup'):
+            cleanup = clean_backup(save_destination, recent_backup_destination)
+        progress_update(f'[bold cyan]Removed:[/] {cleanup.removed_files} files, {cleanup.removed_folders} folders in {cleanup.elapsed:.1f}s')
+
+    if export_errors:
+        console.print()
+        progress_update(f'[bold yellow]Google Documents Not Exported:[/] {export_errors}, check the log for more details.')
+
+    if content_store:
+        removed, freed = content_store.collect_garbage()
+        if removed:
+            console.print()
+            progress_update(f'[bold cyan]Content Store:[/] removed {removed} unused files, freed {format_size(freed)}')
+
+    if export_cache:
+        console.print()
+        progress_update(f'[bold cyan]Export Cache:[/] {export_cache.hits} hits, {export_cache.misses} misses')
+
+    if scheduler.quota_errors:
+        console.print()
+        progress_update(f'[bold cyan]Quota Stalls:[/] {scheduler.quota_errors} quota errors, waited {scheduler.quota_stall_time:.1f}s')
 
     console.print()
     progress_update(f'[bold cyan]Backup Complete!')
+    store_drive_listing(start_page_token)
     config.store_config()
+    if manifest:
+        manifest.close()
+    journal.finish()
+    store_stats(completed=True)
+    stop_logging()
 
     if config.notifications:
         show_notification(title=APPLICATION_NAME, body="Drive Backup is complete!")
@@ -0,0 +1,83 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+class ExportCache(object):
+    # Exported Google Documents kept on disk by file id, version and export mimeType, so unchanged
+    # documents aren't exported again by later backups. The modified time of an entry is when it
+    # was last used, the least recently used entries are removed once the cache is over max_size.
+    SUFFIX = '.export'
+
+    def __init__(self, cache_path, max_size):
+        self.path = cache_path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in self._scan())
+
+    @staticmethod
+    def get_key(drive_file, export_mime_type):
+        version = drive_file.get('version') or drive_file.get('modifiedTime')
+        return hashlib.sha256(f"{drive_file['id']}\0{version}\0{export_mime_type}".encode('utf-8')).hexdigest()
+
+    def get(self, key, destination):
+        # destination is a path or a file opened for writing, and the same goes for source in put()
+        entry_path = self.path / (key + self.SUFFIX)
+        try:
+            if hasattr(destination, 'write'):
+                with entry_path.open('rb') as f:
+                    shutil.copyfileobj(f, destination)
+            else:
+                shutil.copyfile(entry_path, destination)
+            os.utime(entry_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, source):
+        logger = logging.getLogger(__name__)
+        entry_path = self.path / (key + self.SUFFIX)
+        temp_path = self.path / f'{key}.{threading.get_ident()}.tmp'
+        try:
+            if hasattr(source, 'read'):
+                with temp_path.open('wb') as f:
+                    shutil.copyfileobj(source, f)
+            else:
+                shutil.copyfile(source, temp_path)
+            size = temp_path.stat().st_size
+            temp_path.replace(entry_path)
+        except OSError:
+            logger.warning(f"Could not add '{source}' to the export cache.", exc_info=True)
+            temp_path.unlink(missing_ok=True)
+            return
+        with self._lock:
+            self._size += size
+            over_size = self._size > self.max_size
+        if over_size:
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = sorted(self._scan(), key=lambda entry: entry.stat().st_mtime)
+            self._size = sum(entry.stat().st_size for entry in entries)
+            for entry in entries:
+                if self._size <= self.max_size:
+                    break
+                size = entry.stat().st_size
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+                self._size -= size
+
+    def _scan(self):
+        with os.scandir(self.path) as entries:
+            return [entry for entry in entries if entry.name.endswith(self.SUFFIX) and entry.is_file()]
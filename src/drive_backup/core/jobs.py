@@ -0,0 +1,120 @@
+import collections
+import logging
+import multiprocessing
+import queue
+import time
+from .config import DEFAULT_BACKUP_CONFIG
+
+class BackupJob(object):
+    # One of the backups run by BackupJobRunner, updated from the events its process sends
+    def __init__(self, index, backup_config):
+        backup_config = backup_config.resolve()
+        if backup_config.is_dir():
+            backup_config = backup_config / DEFAULT_BACKUP_CONFIG
+        self.index = index
+        self.backup_config = backup_config
+        # Backups using the default .bkp name are told apart by the folder they are in
+        self.name = backup_config.parent.name if backup_config.name == DEFAULT_BACKUP_CONFIG else backup_config.stem
+        self.progress = {'state': 'READY', 'files': 0, 'total_files': 0, 'speed': None, 'eta': None}
+        self.result = None
+        self.process = None
+
+class BackupJobRunner(object):
+    # Runs the backups of several .bkp files at the same time. The backup keeps its state in module
+    # globals, so every backup runs in its own process. The processes share one semaphore that limits
+    # how many requests all of them can have waiting on Google Drive, and send their progress and
+    # result back as events. on_update is called with a job each time one of its events arrives.
+    def __init__(self, backup_configs, workers=None, max_jobs=None, on_update=None):
+        self.jobs = [BackupJob(index, backup_config) for index, backup_config in enumerate(backup_configs)]
+        self.workers = workers
+        self.max_jobs = max_jobs or len(self.jobs)
+        self.on_update = on_update
+        self._context = multiprocessing.get_context('spawn')
+
+    def run(self):
+        events = self._context.Queue()
+        shared_slots = self._context.BoundedSemaphore(self.workers) if self.workers else None
+        waiting = collections.deque(self.jobs)
+        running = {}
+        while waiting or running:
+            while waiting and len(running) < self.max_jobs:
+                job = waiting.popleft()
+                job.process = self._context.Process(target=run_backup_job, args=(job.index, job.backup_config, shared_slots, events), name=f'backup-{job.index}')
+                job.process.start()
+                running[job.index] = job
+
+            try:
+                self._handle_event(events.get(timeout=0.5), running)
+            except queue.Empty:
+                pass
+
+            # Checked after every event, jobs still sending progress would otherwise hide one that crashed
+            ended = [job for job in running.values() if not job.process.is_alive()]
+            if not ended:
+                continue
+            # Events sent before a process ended are handled first, one that ended without sending its result crashed
+            while True:
+                try:
+                    self._handle_event(events.get_nowait(), running)
+                except queue.Empty:
+                    break
+            for job in ended:
+                if job.index in running:
+                    job.process.join()
+                    job.progress['state'] = 'STOP'
+                    job.result = {'completed': False, 'exitcode': job.process.exitcode}
+                    del running[job.index]
+                    self._update(job)
+        return self.jobs
+
+    def _handle_event(self, event, running):
+        kind, index, data = event
+        job = self.jobs[index]
+        if kind == 'progress':
+            job.progress = data
+        elif kind == 'result':
+            job.result = data
+            job.process.join()
+            del running[index]
+        self._update(job)
+
+    def _update(self, job):
+        if self.on_update is not None:
+            self.on_update(job)
+
+def run_backup_job(index, backup_config, shared_slots, events):
+    # Runs in the job's own process
+    from . import drivebackup, config, progress, console
+
+    def send_progress(progress):
+        events.put(('progress', index, {
+            'state': progress.state.name,
+            'files': progress.file_cnt,
+            'total_files': progress.total_files,
+            'speed': progress.speed,
+            'eta': progress.eta
+        }))
+
+    # The process running all of the jobs shows their progress, each job's messages go to its log
+    console.quiet = True
+    drivebackup.shared_request_slots = shared_slots
+    progress.subscribe(send_progress)
+    start_time = time.monotonic()
+    completed = False
+    try:
+        config.set_config({'backup_config': str(backup_config)})
+        drivebackup.run_drive_backup()
+        completed = True
+    except SystemExit:
+        pass
+    except Exception:
+        logger = logging.getLogger(__name__)
+        logger.critical('The backup stopped because of an unexpected error.', exc_info=True)
+    events.put(('result', index, {
+        'completed': completed,
+        'files': progress.file_cnt,
+        'downloaded_bytes': progress.downloaded_bytes,
+        'export_errors': drivebackup.export_errors,
+        'elapsed': time.monotonic() - start_time,
+        'destination': str(config.destination)
+    }))
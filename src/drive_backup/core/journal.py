@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+import threading
+
+class BackupJournal(object):
+    SYNC_INTERVAL = 100
+
+    def __init__(self, journal_path):
+        self.path = journal_path
+        self.backup = None
+        self.prev_backup = None
+        self.drive_listing = None
+        self._completed = set()
+        self._file = None
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        logger = logging.getLogger(__name__)
+        try:
+            with self.path.open(encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last record may have been cut off when the backup stopped
+                        logger.info(f"Ignoring incomplete record in backup journal '{self.path}'")
+                        break
+                    self._load_record(record)
+        except FileNotFoundError:
+            return False
+        if self.backup is None:
+            return False
+        self._file = self.path.open('a', encoding='utf-8')
+        return True
+
+    def start(self, backup, prev_backup):
+        self.backup = backup
+        self.prev_backup = prev_backup
+        self._file = self.path.open('w', encoding='utf-8')
+        self._write({'type': 'start', 'backup': backup, 'prev_backup': prev_backup}, sync=True)
+
+    def record_listing(self, drive_listing):
+        self._write({'type': 'listing', 'listing': drive_listing}, sync=True)
+
+    def record_file(self, file_id, relative_path):
+        self._write({'type': 'file', 'id': file_id, 'path': relative_path})
+
+    def is_complete(self, file_id, relative_path):
+        return (file_id, relative_path) in self._completed
+
+    def finish(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def _load_record(self, record):
+        if record['type'] == 'start':
+            self.backup = record['backup']
+            self.prev_backup = record['prev_backup']
+        elif record['type'] == 'listing':
+            self.drive_listing = record['listing']
+        elif record['type'] == 'file':
+            self._completed.add((record['id'], record['path']))
+
+    def _write(self, record, sync=False):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(record) + '\n')
+            self._unsynced += 1
+            if sync or self._unsynced >= self.SYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
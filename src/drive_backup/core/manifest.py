@@ -0,0 +1,107 @@
+import collections
+import logging
+import sqlite3
+import threading
+
+class BackupManifest(object):
+    Manifest_record = collections.namedtuple('Manifest_record', ['file_id', 'size', 'modified_time', 'md5_checksum', 'head_revision_id', 'version', 'export_mime_type'])
+    COLUMNS = ('backup', 'path') + Manifest_record._fields
+    BATCH_SIZE = 1000
+
+    def __init__(self, manifest_path, root, read_only=False):
+        self.root = root
+        self._lock = threading.Lock()
+        self._pending = []
+        if read_only:
+            # Nothing is changed, an older manifest is read without the columns added since
+            self._connection = sqlite3.connect(f'{manifest_path.resolve().as_uri()}?mode=ro', uri=True, check_same_thread=False)
+            columns = self._get_columns()
+            self._select_fields = ', '.join(field if field in columns else 'NULL' for field in self.Manifest_record._fields) if columns else None
+            return
+        self._select_fields = ', '.join(self.Manifest_record._fields)
+        self._connection = sqlite3.connect(manifest_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'backup TEXT NOT NULL, path TEXT NOT NULL, file_id TEXT NOT NULL, size INTEGER, '
+                'modified_time TEXT, md5_checksum TEXT, export_mime_type TEXT, PRIMARY KEY (backup, path))'
+            )
+            columns = self._get_columns()
+            for column in ('head_revision_id', 'version'):
+                if column not in columns:
+                    self._connection.execute(f'ALTER TABLE files ADD COLUMN {column} TEXT')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS files_file_id ON files (file_id)')
+        self._remove_missing_backups()
+
+    def get_record(self, path):
+        if self._select_fields is None:
+            return None
+        backup, relative_path = self._split_path(path)
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {self._select_fields} FROM files WHERE backup = ? AND path = ?",
+                (backup, relative_path)
+            ).fetchone()
+        return self.Manifest_record(*row) if row else None
+
+    def add(self, path, drive_file, export_mime_type=None):
+        backup, relative_path = self._split_path(path)
+        size = int(drive_file['size']) if drive_file.get('size') is not None else None
+        self._queue(
+            f"INSERT OR REPLACE INTO files ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+            (backup, relative_path, drive_file['id'], size, drive_file.get('modifiedTime'), drive_file.get('md5Checksum'),
+             drive_file.get('headRevisionId'), drive_file.get('version'), export_mime_type)
+        )
+
+    def remove(self, path):
+        backup, relative_path = self._split_path(path)
+        self._queue(
+            'DELETE FROM files WHERE backup = ? AND (path = ? OR substr(path, 1, ?) = ?)',
+            (backup, relative_path, len(relative_path) + 1, relative_path + '/')
+        )
+
+    def rename_backup(self, old_backup, new_backup):
+        with self._lock:
+            self._pending.append(('DELETE FROM files WHERE backup = ?', (new_backup,)))
+            self._pending.append(('UPDATE files SET backup = ? WHERE backup = ?', (new_backup, old_backup)))
+            self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def _queue(self, statement, parameters):
+        with self._lock:
+            self._pending.append((statement, parameters))
+            if len(self._pending) >= self.BATCH_SIZE:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        try:
+            with self._connection:
+                for statement, parameters in self._pending:
+                    self._connection.execute(statement, parameters)
+        except sqlite3.Error:
+            logger = logging.getLogger(__name__)
+            logger.warning('Could not update the backup manifest.', exc_info=True)
+        self._pending = []
+
+    def _get_columns(self):
+        return {row[1] for row in self._connection.execute('PRAGMA table_info(files)')}
+
+    def _split_path(self, path):
+        parts = path.relative_to(self.root).parts
+        return (parts[0], '/'.join(parts[1:]))
+
+    def _remove_missing_backups(self):
+        backups = [row[0] for row in self._connection.execute('SELECT DISTINCT backup FROM files')]
+        with self._connection:
+            for backup in backups:
+                if not (self.root / backup).is_dir():
+                    self._connection.execute('DELETE FROM files WHERE backup = ?', (backup,))
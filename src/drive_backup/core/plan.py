@@ -0,0 +1,87 @@
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+from .dfsmap import DriveFile
+
+class BackupPlan(object):
+    VERSION = 1
+    ACTIONS = ('download', 'export', 'empty', 'copy', 'move', 'skip', 'unsupported')
+    FETCH_ACTIONS = ('download', 'export', 'empty')
+
+    def __init__(self, backup, prev_backup, backup_type, keep_files=False):
+        self.backup = backup
+        self.prev_backup = prev_backup
+        self.backup_type = backup_type
+        self.summary = {action: {'files': 0, 'bytes': 0} for action in self.ACTIONS}
+        # Files fetched at another path first, the backup links them instead of fetching them again
+        self.summary['linked'] = {'files': 0, 'bytes': 0}
+        self.folders = []
+        self._keep_files = keep_files
+        self._fetched_ids = set()
+
+    def add_folder(self, path, folder_names):
+        if self._keep_files:
+            self.folders.append({'path': list(path), 'folders': list(folder_names), 'files': []})
+
+    def add_file(self, drive_file, action):
+        self.summary[action]['files'] += 1
+        if action in self.FETCH_ACTIONS and drive_file['id'] in self._fetched_ids:
+            self.summary['linked']['files'] += 1
+            self.summary['linked']['bytes'] += int(drive_file.get('size', 0))
+        else:
+            self.summary[action]['bytes'] += int(drive_file.get('size', 0))
+            if action in self.FETCH_ACTIONS:
+                self._fetched_ids.add(drive_file['id'])
+        if self._keep_files:
+            entry = {field: drive_file[field] for field in DriveFile.FIELDS if drive_file[field] is not None}
+            entry['action'] = action
+            self.folders[-1]['files'].append(entry)
+
+    def get_files(self, *actions):
+        return sum(self.summary[action]['files'] for action in actions)
+
+    def get_bytes(self, *actions):
+        return sum(self.summary[action]['bytes'] for action in actions)
+
+    def get_actions(self, save_destination):
+        # Keyed by file id and the folder it is saved in, a file with several parents can have a different action in each
+        actions = {}
+        for folder in self.folders:
+            folder_location = save_destination.joinpath(*folder['path'])
+            for entry in folder['files']:
+                actions[(entry['id'], folder_location)] = entry['action']
+        return actions
+
+    def store(self, plan_path):
+        with plan_path.open('w', encoding='utf-8') as f:
+            json.dump({
+                'version': self.VERSION,
+                'created': datetime.now(timezone.utc).isoformat(),
+                'backup': self.backup,
+                'prev_backup': self.prev_backup,
+                'backup_type': self.backup_type,
+                'summary': self.summary,
+                'folders': self.folders
+            }, f)
+
+    @classmethod
+    def load(cls, plan_path):
+        logger = logging.getLogger(__name__)
+        try:
+            with plan_path.open(encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logger.critical(f"Backup plan '{plan_path}' could not be found.")
+            sys.exit(1)
+        except json.JSONDecodeError:
+            logger.critical(f"Backup plan '{plan_path}' is not a valid plan.")
+            sys.exit(1)
+        if data.get('version') != cls.VERSION:
+            logger.critical(f"Backup plan '{plan_path}' was made by a different version of Drive Backup, make a new plan with --dry-run.")
+            sys.exit(1)
+        plan = cls(data['backup'], data['prev_backup'], data['backup_type'], keep_files=True)
+        plan.summary.update(data['summary'])
+        plan.folders = data['folders']
+        return plan
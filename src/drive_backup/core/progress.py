@@ -1,6 +1,15 @@
+import collections
+import threading
+import time
 from enum import Enum
 
 class Progress:
+    # Subscribers are called when the state changes and otherwise at most every PUBLISH_INTERVAL,
+    # so a burst of small files doesn't redraw the display for each one
+    PUBLISH_INTERVAL = 0.1
+    # How far back the download speed is averaged over
+    SPEED_WINDOW = 5.0
+
     class State(Enum):
         READY       = 0
         INITIATE    = 1
@@ -11,19 +20,98 @@ class Progress:
         STOP        = 6
 
     def __init__(self):
-        self.total_files = 0
+        self._state = self.State.READY
+        self._total_files = 0
         self.total_folders = 0
-        self.file_cnt = 0
+        self.total_bytes = 0
         self.folder_cnt = 0
-        self.state = self.State.READY
+        self.speed = None
+        self._counters = []
+        self._local = threading.local()
+        self._samples = collections.deque()
+        self._last_publish = 0.0
+        self._publish_lock = threading.Lock()
         self._subs = []
-        self._inited = True
 
-    def __setattr__(self, name, value):
-        object.__setattr__(self, name, value)
-        if not name.startswith("_") and getattr(self, "_inited", False):
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, value):
+        self._state = value
+        self.publish(force=True)
+
+    @property
+    def total_files(self):
+        return self._total_files
+
+    @total_files.setter
+    def total_files(self, value):
+        self._total_files = value
+        self.publish()
+
+    @property
+    def file_cnt(self):
+        return sum(counter[0] for counter in tuple(self._counters))
+
+    @property
+    def completed_bytes(self):
+        # The size of every file handled so far, downloaded or not
+        return sum(counter[1] for counter in tuple(self._counters))
+
+    @property
+    def downloaded_bytes(self):
+        return sum(counter[2] for counter in tuple(self._counters))
+
+    @property
+    def eta(self):
+        if not self.speed or not self.total_bytes:
+            return None
+        return max(0, self.total_bytes - self.completed_bytes) / self.speed
+
+    def add_file(self, size=0):
+        counter = self._get_counter()
+        counter[0] += 1
+        counter[1] += size
+        self.publish()
+
+    def add_bytes(self, byte_count):
+        self._get_counter()[2] += byte_count
+        self.publish()
+
+    def _get_counter(self):
+        # Each thread only adds to its own counter, the totals are summed when they are read
+        counter = getattr(self._local, 'counter', None)
+        if counter is None:
+            counter = [0, 0, 0]
+            self._local.counter = counter
+            self._counters.append(counter)
+        return counter
+
+    def publish(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_publish < self.PUBLISH_INTERVAL:
+            return
+        # Another thread already publishing has these updates covered
+        if not self._publish_lock.acquire(blocking=force):
+            return
+        try:
+            self._last_publish = now
+            self._update_speed(now)
             for sub in self._subs:
                 sub(self)
+        finally:
+            self._publish_lock.release()
+
+    def _update_speed(self, now):
+        downloaded_bytes = self.downloaded_bytes
+        self._samples.append((now, downloaded_bytes))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.SPEED_WINDOW:
+            self._samples.popleft()
+        start_time, start_bytes = self._samples[0]
+        if now - start_time >= self.PUBLISH_INTERVAL:
+            self.speed = (downloaded_bytes - start_bytes) / (now - start_time)
 
     def subscribe(self, callback):
         self._subs.append(callback)
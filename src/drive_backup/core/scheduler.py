@@ -0,0 +1,139 @@
+import contextlib
+import json
+import logging
+import random
+import threading
+import time
+import httplib2
+from googleapiclient import errors
+
+QUOTA_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+MAX_BACKOFF = 64
+
+class RequestScheduler(object):
+    def __init__(self, requests_per_second=None, max_concurrent_requests=None, num_retries=5, stats=None, shared_slots=None):
+        self.requests_per_second = requests_per_second
+        self.stats = stats
+        self.num_retries = num_retries
+        self.quota_errors = 0
+        self.quota_stall_time = 0.0
+        self._burst = max(1.0, requests_per_second or 0)
+        self._tokens = self._burst
+        self._last_refill = time.monotonic()
+        self._backoff_until = 0.0
+        self._consecutive_quota_errors = 0
+        self._lock = threading.Lock()
+        # shared_slots is a semaphore shared with other backups running at the same time
+        self._slots = [slots for slots in (threading.BoundedSemaphore(max_concurrent_requests) if max_concurrent_requests else None, shared_slots) if slots]
+
+    def execute(self, request, num_retries=None):
+        return self.call(request.execute, num_retries=num_retries, method=request.methodId.removeprefix('drive.'))
+
+    def call(self, function, num_retries=None, method='other'):
+        logger = logging.getLogger(__name__)
+        if num_retries is None:
+            num_retries = self.num_retries
+        attempt = 0
+        while True:
+            self._wait_for_backoff()
+            self._take_token()
+            start_time = time.monotonic()
+            try:
+                with contextlib.ExitStack() as stack:
+                    for slots in self._slots:
+                        stack.enter_context(slots)
+                    result = function()
+            except errors.HttpError as e:
+                self._record_request(method, start_time, error=True)
+                if attempt >= num_retries:
+                    raise
+                if is_quota_error(e):
+                    self._quota_backoff(e)
+                elif e.resp.status >= 500:
+                    self._backoff(attempt)
+                else:
+                    raise
+                self._record_retry(method)
+                logger.info(f'Retrying Drive request after HTTP {e.resp.status} (attempt {attempt + 1})')
+            except (OSError, httplib2.HttpLib2Error):
+                self._record_request(method, start_time, error=True)
+                if attempt >= num_retries:
+                    raise
+                self._record_retry(method)
+                logger.info(f'Retrying Drive request after a connection error (attempt {attempt + 1})', exc_info=True)
+                self._backoff(attempt)
+            else:
+                self._record_request(method, start_time)
+                with self._lock:
+                    self._consecutive_quota_errors = 0
+                return result
+            attempt += 1
+
+    def _record_request(self, method, start_time, error=False):
+        if self.stats is not None:
+            self.stats.record_request(method, time.monotonic() - start_time, error)
+
+    def _record_retry(self, method):
+        if self.stats is not None:
+            self.stats.record_retry(method)
+
+    def _backoff(self, attempt):
+        delay = get_backoff(attempt)
+        if self.stats is not None:
+            self.stats.record_backoff(delay)
+        time.sleep(delay)
+
+    def _take_token(self):
+        if not self.requests_per_second:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._last_refill) * self.requests_per_second)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.requests_per_second
+            time.sleep(wait)
+
+    def _wait_for_backoff(self):
+        while True:
+            with self._lock:
+                wait = self._backoff_until - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _quota_backoff(self, error):
+        # Every request waits on the same backoff, so a burst of quota errors
+        # slows everything down together instead of each request on its own
+        retry_after = error.resp.get('retry-after')
+        with self._lock:
+            self.quota_errors += 1
+            if retry_after and retry_after.isdigit():
+                delay = int(retry_after)
+            else:
+                delay = get_backoff(self._consecutive_quota_errors)
+            self._consecutive_quota_errors += 1
+            if self.stats is not None:
+                self.stats.record_backoff(delay)
+            now = time.monotonic()
+            backoff_until = now + delay
+            if backoff_until > self._backoff_until:
+                self.quota_stall_time += backoff_until - max(self._backoff_until, now)
+                self._backoff_until = backoff_until
+
+def get_backoff(attempt):
+    return min(MAX_BACKOFF, 2 ** attempt) + random.random()
+
+def is_quota_error(error):
+    if error.resp.status == 429:
+        return True
+    if error.resp.status != 403:
+        return False
+    try:
+        data = json.loads(error.content.decode('utf-8'))
+        return data['error']['errors'][0]['reason'] in QUOTA_REASONS
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return False
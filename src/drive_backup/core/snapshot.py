@@ -0,0 +1,58 @@
+import os
+import sys
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+def snapshot_file(src, dst, mode='copy'):
+    dst.unlink(missing_ok=True)
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    if mode in ('hardlink', 'clone') and clone_file(src, dst):
+        return 'clone'
+    shutil.copy2(src, dst)
+    return 'copy'
+
+def clone_file(src, dst):
+    cloned = False
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            if fcntl is not None and sys.platform.startswith('linux'):
+                try:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                    cloned = True
+                except OSError:
+                    pass
+            if not cloned and hasattr(os, 'copy_file_range'):
+                cloned = copy_file_range(fsrc.fileno(), fdst.fileno(), os.fstat(fsrc.fileno()).st_size)
+    except OSError:
+        cloned = False
+
+    if not cloned:
+        dst.unlink(missing_ok=True)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+def copy_file_range(src_fd, dst_fd, size):
+    # The kernel shares extents when the filesystem supports it (btrfs, xfs, ...)
+    copied = 0
+    try:
+        while copied < size:
+            sent = os.copy_file_range(src_fd, dst_fd, size - copied)
+            if sent == 0:
+                break
+            copied += sent
+    except OSError:
+        return False
+    return copied == size
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Upper bounds in seconds of each latency histogram bucket, the last bucket holds everything slower
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class RequestStats(object):
+    __slots__ = ('count', 'errors', 'retries', 'total_time', 'max_time', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def to_dict(self):
+        labels = [f'<={bound}s' for bound in LATENCY_BUCKETS] + [f'>{LATENCY_BUCKETS[-1]}s']
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'total_time': round(self.total_time, 3),
+            'mean_time': round(self.total_time / self.count, 4) if self.count else None,
+            'max_time': round(self.max_time, 3),
+            'histogram': dict(zip(labels, self.histogram))
+        }
+
+class BackupStats(object):
+    # Wall time of each phase of a backup along with the count, latency, retries and bytes of every
+    # Drive request, recorded from any thread and written out as JSON next to the .bkp file
+    def __init__(self):
+        self.started = datetime.now(timezone.utc)
+        self.phases = {}
+        self.thread_times = {}
+        self.requests = {}
+        self.bytes = {}
+        self.backoffs = 0
+        self.backoff_time = 0.0
+        self._start_time = time.monotonic()
+        self._lock = threading.Lock()
+        self._active_phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase_time(name, time.monotonic() - start_time)
+
+    @contextmanager
+    def thread_phase(self, name):
+        # A phase that runs on several threads at once. Its wall time is counted while any thread
+        # is in it, the time of every thread added up is kept separately in thread_times
+        start_time = time.monotonic()
+        with self._lock:
+            active, phase_start = self._active_phases.get(name, (0, start_time))
+            self._active_phases[name] = (active + 1, phase_start)
+        try:
+            yield
+        finally:
+            end_time = time.monotonic()
+            with self._lock:
+                active, phase_start = self._active_phases[name]
+                if active == 1:
+                    del self._active_phases[name]
+                    self.phases[name] = self.phases.get(name, 0.0) + end_time - phase_start
+                else:
+                    self._active_phases[name] = (active - 1, phase_start)
+                self.thread_times[name] = self.thread_times.get(name, 0.0) + end_time - start_time
+
+    def add_phase_time(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def record_request(self, method, seconds, error=False):
+        with self._lock:
+            self._get_request_stats(method).add(seconds, error)
+
+    def record_retry(self, method):
+        with self._lock:
+            self._get_request_stats(method).retries += 1
+
+    def record_backoff(self, seconds):
+        with self._lock:
+            self.backoffs += 1
+            self.backoff_time += seconds
+
+    def record_bytes(self, method, byte_count):
+        with self._lock:
+            self.bytes[method] = self.bytes.get(method, 0) + byte_count
+
+    def _get_request_stats(self, method):
+        request_stats = self.requests.get(method)
+        if request_stats is None:
+            request_stats = RequestStats()
+            self.requests[method] = request_stats
+        return request_stats
+
+    def to_dict(self, **summary):
+        with self._lock:
+            return summary | {
+                'started': self.started.isoformat(),
+                'total_time': round(time.monotonic() - self._start_time, 3),
+                'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                'thread_times': {name: round(seconds, 3) for name, seconds in self.thread_times.items()},
+                'requests': {method: request_stats.to_dict() for method, request_stats in sorted(self.requests.items())},
+                'retries': sum(request_stats.retries for request_stats in self.requests.values()),
+                'backoffs': self.backoffs,
+                'backoff_time': round(self.backoff_time, 3),
+                'bytes': dict(self.bytes)
+            }
+
+    def store(self, stats_path, **summary):
+        with stats_path.open('w', encoding='utf-8') as f:
+            json.dump(self.to_dict(**summary), f, indent=2)
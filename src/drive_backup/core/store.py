@@ -0,0 +1,75 @@
+import os
+import threading
+
+class ContentStore(object):
+    # Keeps the body of every backed up file once, named by its md5 hash, and each backup's files are
+    # hardlinks to it. The link count of an entry is its reference count, an entry only the store
+    # links to isn't used by any backup anymore and is removed by collect_garbage().
+    def __init__(self, store_path):
+        self.path = store_path
+        self._lock = threading.Lock()
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def get_entry_path(self, digest):
+        return self.path / digest[:2] / digest
+
+    def add(self, source, digest, destination):
+        # Moves source into the store unless the same content is already there, then links destination
+        # to it. Returns True when the content was new.
+        entry_path = self.get_entry_path(digest)
+        with self._lock:
+            new_entry = not entry_path.exists()
+            if new_entry:
+                entry_path.parent.mkdir(exist_ok=True)
+                os.replace(source, entry_path)
+        if not new_entry:
+            os.unlink(source)
+        temp_destination = destination.with_name(destination.name + '.link')
+        temp_destination.unlink(missing_ok=True)
+        os.link(entry_path, temp_destination)
+        os.replace(temp_destination, destination)
+        return new_entry
+
+    def supports_hardlinks(self):
+        probe_path = self.path / 'probe'
+        link_path = self.path / 'probe.link'
+        try:
+            probe_path.touch()
+            os.link(probe_path, link_path)
+            return True
+        except OSError:
+            return False
+        finally:
+            link_path.unlink(missing_ok=True)
+            probe_path.unlink(missing_ok=True)
+
+    def collect_garbage(self):
+        removed = 0
+        freed = 0
+        for entry in self._scan():
+            stat = entry.stat()
+            if stat.st_nlink <= 1:
+                os.unlink(entry.path)
+                removed += 1
+                freed += stat.st_size
+        return (removed, freed)
+
+    def get_usage(self):
+        # Returns the number of entries, the space they take up and the space the backups linking to them would take without the store
+        entries = 0
+        stored = 0
+        referenced = 0
+        for entry in self._scan():
+            stat = entry.stat()
+            entries += 1
+            stored += stat.st_size
+            referenced += stat.st_size * max(stat.st_nlink - 1, 0)
+        return (entries, stored, referenced)
+
+    def _scan(self):
+        with os.scandir(self.path) as folders:
+            for folder in folders:
+                if not folder.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(folder.path) as entries:
+                    yield from [entry for entry in entries if entry.is_file(follow_symlinks=False)]